@@ -0,0 +1,159 @@
+# Structure-of-arrays storage for the game's many small actors
+# (asteroids and bullets).
+#
+# Every actor owns one row in a set of parallel NumPy columns, so the whole
+# population can be moved with a single vectorised operation per frame. The
+# Asteroid and Bullet classes are thin views that hold a reference to their
+# store and their row index; the store keeps no views, it makes one when a
+# row is asked for.
+
+import numpy as np
+
+
+def wrappedLerp(previous, current, alpha, period):
+    # interpolate from previous to current along the shortest way round a
+    # wrap-around axis of length period (works on scalars and arrays)
+    delta = (current - previous + period / 2.0) % period - period / 2.0
+    return (previous + delta * alpha) % period
+
+
+def storeColumn(name):
+    # a property that reads/writes this actor's row of the named column
+    def fget(self):
+        return getattr(self.store, name)[self.index]
+
+    def fset(self, value):
+        getattr(self.store, name)[self.index] = value
+        self.store.generation += 1
+
+    return property(fget, fset)
+
+
+class ActorStore(object):
+    COLUMNS = (
+        ("x", np.float64),
+        ("y", np.float64),
+        ("px", np.float64),   # position before the last move,
+        ("py", np.float64),   # used for interpolated drawing
+        ("vx", np.float64),
+        ("vy", np.float64),
+        ("direction", np.float64),
+        ("size", np.int32),
+        ("age", np.float64),
+    )
+
+    def __init__(self, capacity=64, makeView=None):
+        # makeView(i) makes a view onto row i
+        self.count = 0
+        self.capacity = capacity
+        self.makeView = makeView
+
+        # bumped whenever any row changes, so derived structures such as a
+        # SpatialGrid can tell when they need rebuilding
+        self.generation = 0
+        for name, dtype in ActorStore.COLUMNS:
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.makeView(i)
+
+    def grow(self, capacity):
+        for name, dtype in ActorStore.COLUMNS:
+            column = np.zeros(capacity, dtype=dtype)
+            column[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def add(self, x, y, vx, vy, direction, size=0, age=0):
+        if self.count == self.capacity:
+            self.grow(self.capacity * 2)
+
+        i = self.count
+        self.x[i] = self.px[i] = x
+        self.y[i] = self.py[i] = y
+        self.vx[i] = vx
+        self.vy[i] = vy
+        self.direction[i] = direction
+        self.size[i] = size
+        self.age[i] = age
+
+        self.count += 1
+        self.generation += 1
+        return i
+
+    def compact(self, keep):
+        # drop every row whose entry in the boolean mask `keep` is False,
+        # preserving the order of the remaining rows
+        n = self.count
+        keep = np.asarray(keep, dtype=bool)
+        kept = int(keep.sum())
+        if kept == n:
+            return
+
+        for name, _ in ActorStore.COLUMNS:
+            column = getattr(self, name)
+            column[:kept] = column[:n][keep]
+
+        self.count = kept
+        self.generation += 1
+
+    def remove(self, index):
+        keep = np.ones(self.count, dtype=bool)
+        keep[index] = False
+        self.compact(keep)
+
+    def clear(self):
+        self.count = 0
+        self.generation += 1
+
+    def pack(self):
+        # every live row as one string: each column's rows in turn, in
+        # COLUMNS order (so the layout only depends on count)
+        n = self.count
+        return "".join([getattr(self, name)[:n].tostring() for name, _ in ActorStore.COLUMNS])
+
+    @staticmethod
+    def packedSize(count):
+        return count * sum(np.dtype(dtype).itemsize for _, dtype in ActorStore.COLUMNS)
+
+    def unpack(self, data, offset, count):
+        # replace every row with count rows packed into data at offset;
+        # returns the offset just past them
+        if count > self.capacity:
+            self.grow(max(count, self.capacity * 2))
+        for name, dtype in ActorStore.COLUMNS:
+            column = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            getattr(self, name)[:count] = column
+            offset += column.nbytes
+        self.count = count
+        self.generation += 1
+        return offset
+
+    def move(self, width, height, ticks=1.0):
+        # velocities are in pixels per tick; ticks is how many (or what
+        # fraction of a) tick this move covers
+        n = self.count
+        self.px[:n] = self.x[:n]
+        self.py[:n] = self.y[:n]
+        if ticks == 1.0:
+            np.add(self.x[:n], self.vx[:n], out=self.x[:n])
+            np.add(self.y[:n], self.vy[:n], out=self.y[:n])
+        else:
+            self.x[:n] += self.vx[:n] * ticks
+            self.y[:n] += self.vy[:n] * ticks
+        np.mod(self.x[:n], width, out=self.x[:n])
+        np.mod(self.y[:n], height, out=self.y[:n])
+        self.generation += 1
+
+    def interpolate(self, alpha, width, height):
+        # positions alpha of the way through the last move
+        n = self.count
+        if alpha == 1.0:
+            return self.x[:n], self.y[:n]
+        return (wrappedLerp(self.px[:n], self.x[:n], alpha, width),
+                wrappedLerp(self.py[:n], self.y[:n], alpha, height))
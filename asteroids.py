@@ -24,7 +24,12 @@ from pygame.locals import *
 import sys
 import math
 import random
+import struct
 import numpy as np
+from actorstore import ActorStore, storeColumn, wrappedLerp
+from spatialgrid import SpatialGrid
+from recording import Recorder, Recording
+from renderer import DirtyRectRenderer, FrameBuffer, ScoreHud, SpriteAtlas, getFont, textCache
 
 # pedro stuff
 import pedroclient
@@ -32,18 +37,34 @@ import pedroclient
 # general stuff
 import argparse
 import threading
+import time
 import Queue 
 
 
 CURRENT_COLOURS = colors.dayColourPalette
 FRAMES_PER_SECOND = 50
-
-def translateVectors(vec,x,y):
-    return [[v[0]+x,v[1]+y] for v in vec]
-
-def mult2DVecAndMatrix(vec,matrix):
-    x,y = vec
-    return [matrix[0][0]*vec[0] + matrix[0][1]*vec[1], matrix[1][0]*vec[0] + matrix[1][1]*vec[1]]
+# Speeds, accelerations, turning and bullet lifetimes are all expressed per
+# tick at this rate, whatever rate the simulation is actually stepped at.
+TICKS_PER_SECOND = 50
+TICK = 1.0 / TICKS_PER_SECOND
+# a frame that takes longer than this is not caught up on in full, so one
+# long stall can't make the simulation spiral
+MAX_FRAME_TIME = 0.25
+
+TWO_PI = math.pi * 2
+WORLD_WIDTH, WORLD_HEIGHT = 640, 480
+
+def headingTables(shape, step, count, initialDirection):
+    # For each of count headings step radians apart: the direction faced,
+    # and shape's points turned clockwise by the heading (as a read-only
+    # count x points x 2 array).
+    angles = np.arange(count) * step
+    c = np.cos(angles)[:,np.newaxis]
+    s = np.sin(angles)[:,np.newaxis]
+    xs, ys = np.asarray(shape).T
+    shapes = np.dstack((c*xs - s*ys, s*xs + c*ys))
+    shapes.flags.writeable = False
+    return ((initialDirection + angles) % TWO_PI).tolist(), shapes
 
 def check (font, name):
     bold = "not bold"
@@ -54,21 +75,87 @@ def check (font, name):
 def myround(x, prec=2, base=.05):
   return round(base * round(float(x)/base),prec)
 
-def format_percept( (functor, args) ):
-    arg_str = ",".join([str(a) for a in args])
-    return functor + "(" + arg_str + ")"
+# Percepts are (functor, args) tuples, which pedroclient.TermWriter writes
+# as Prolog terms (and a set of them as a list). The client writes them
+# straight into its send buffer; these are for when the text is wanted.
+def format_percept(percept):
+    writer = pedroclient.TermWriter()
+    writer.write(percept)
+    return str(writer)
+
+def format_percepts(percepts):
+    writer = pedroclient.TermWriter()
+    writer.write(percepts)
+    return str(writer)
+
+class PerceptDiffer(object):
+    # Turns the percept set sensed each frame into the message term to send
+    # to the agent. Usually that is delta(Added, Removed) with the percepts
+    # that appeared and disappeared since the last message, or None when nothing
+    # changed. Every snapshotInterval frames, and after reset() (e.g. when a
+    # new agent connects), the full percept list is sent instead so the agent
+    # can resynchronise.
+    def __init__(self, snapshotInterval=50):
+        self.snapshotInterval = snapshotInterval
+        self.reset()
+
+    def reset(self):
+        self.previous = None
+        self.sinceSnapshot = 0
+
+    def message(self, percepts):
+        self.sinceSnapshot += 1
+        if self.previous is None or self.sinceSnapshot >= self.snapshotInterval:
+            self.previous = percepts
+            self.sinceSnapshot = 0
+            return percepts
+
+        added = percepts - self.previous
+        removed = self.previous - percepts
+        self.previous = percepts
+        if not added and not removed:
+            return None
+        return ("delta", (added, removed))
 
 class Game(object):
-    def __init__(self,surface,easyMode=False, splashScreen=True):
+    # surface is None when running headless: the worlds then simulate
+    # without drawing anything. All of the game's randomness comes from
+    # self.random, so games with the same seed play out the same way.
+    def __init__(self,surface,easyMode=False, splashScreen=True, size=(WORLD_WIDTH,WORLD_HEIGHT), seed=None):
         self.surface = surface
         self.easyMode = easyMode
         self.splashScreen = splashScreen
-
+        self.width, self.height = size
+        self.seed = seed
+        self.random = random.Random(seed)
+
+        # only the parts of the surface that change are redrawn and shown
+        self.renderer = None
+        self.sprites = None
+        if surface is not None:
+            self.renderer = DirtyRectRenderer(surface, CURRENT_COLOURS["background"])
+            self.sprites = getSprites()
+
+        # counts the worlds the game has had, so frames can tell which one
+        # they are of
+        self.worldCount = 0
         if self.splashScreen:
             self.currentWorld = IntroWorld(self,self.surface)
         else:
             self.currentWorld = GameWorld(self,self.surface,easyMode=self.easyMode)
 
+    @property
+    def currentWorld(self):
+        return self._currentWorld
+
+    @currentWorld.setter
+    def currentWorld(self, world):
+        # a new world starts with a clean (and completely shown) surface
+        self._currentWorld = world
+        self.worldCount += 1
+        if self.renderer is not None:
+            self.renderer.invalidate()
+
     def startGame(self):
         self.currentWorld = GameWorld(self,self.surface,easyMode=self.easyMode)
 
@@ -109,18 +196,30 @@ class PausedWorld(object):
             self.game.startGame()
 
 
-    def update(self):
+    def step(self, dt=TICK):
         pass
 
+    def draw(self, alpha=1.0):
+        # nothing changes once the title is up
+        return []
+
+    def frame(self, alpha=1.0):
+        return None
+
 class TitleWorld(PausedWorld):
     def __init__(self,game,surface,text):
         super(TitleWorld,self).__init__(game,surface)
+        self.text = text
 
-        self.titleFont = pygame.font.Font(None,36)
-        self.drawTitle(text)
+        if self.surface is not None:
+            self.titleFont = getFont(None,36)
+            self.drawTitle(text)
 
     def drawTitle(self,text):
-        self.surface.blit(self.titleFont.render(text, False, CURRENT_COLOURS["display"]),(200,200))
+        self.surface.blit(textCache.render(self.titleFont, text, CURRENT_COLOURS["display"]),(200,200))
+
+    def frame(self, alpha=1.0):
+        return Frame(self.game.worldCount, title=self.text)
 
 class IntroWorld(TitleWorld):
     def __init__(self,game,surface):
@@ -140,39 +239,95 @@ class GameWorld(object):
     CENTRE_THRESHOLD = math.pi / 16
     #SIDE_THRESHOLD = math.pi / 6
     SIDE_THRESHOLD = math.pi / 4
+    VISIBILITY_DISTANCE = 300
+
+    # how far clockwise of straight ahead each direction ends, and (as the
+    # original tests had it) how far clockwise the same directions on the
+    # left start, so asteroids right on a boundary fall the same way
+    DIRECTION_BINS = np.array([DEAD_CENTRE_THRESHOLD, CENTRE_THRESHOLD, SIDE_THRESHOLD])
+    LEFT_BINS = TWO_PI - DIRECTION_BINS[::-1]
+    DIRECTION_NAMES = ("dead_centre", "centre", "right", "left")
+
+    # no asteroid is ever bigger than this, so no bullet further than this
+    # from an asteroid's centre can be hitting it
+    MAX_ASTEROID_SIZE = 30
+
+    # magic, width, height, points, justInstantiated, asteroid and bullet counts
+    SNAPSHOT_HEADER = struct.Struct("<4sHHq?II")
+    SNAPSHOT_MAGIC = "AWS2"
+    # a Mersenne Twister state (624 words and a position) and the gauss cache
+    RANDOM_STATE = struct.Struct("<625I?d")
 
 
     def __init__(self,game,surface, easyMode=False):
         self.game = game
         self.surface = surface
         self.easyMode = easyMode
-
-        self.spaceship = Spaceship(self,(320,240))
-        self.bullets = []
-        self.asteroids = []
+        self.width = game.width
+        self.height = game.height
+        self.random = game.random
+
+        self.spaceship = Spaceship(self,(self.width/2,self.height/2))
+        self.bullets = ActorStore(makeView=lambda i: Bullet.viewOf(self, i))
+        self.asteroids = ActorStore(makeView=lambda i: Asteroid.viewOf(self, i))
+        self.asteroidGrid = SpatialGrid(self.width, self.height)
         if not self.easyMode:
             self.populateAsteroids()
         self.points = 0
 
-        self.scoreFont = pygame.font.Font(None, 18)
+        if self.surface is not None:
+            self.hud = ScoreHud(getFont(None, 18), CURRENT_COLOURS["display"], (20,20))
 
         self.justInstantiated = True
 
+    def snapshot(self):
+        # The whole state of the world as a string that restore() can load:
+        # a fixed header, the spaceship, the state of the game's random
+        # number generator and then the packed asteroid and bullet rows.
+        # No objects are pickled, so it doesn't matter that the world holds
+        # on to the surface.
+        version, state, gauss = self.random.getstate()
+        return "".join([
+            GameWorld.SNAPSHOT_HEADER.pack(GameWorld.SNAPSHOT_MAGIC, self.width, self.height,
+                                           self.points, self.justInstantiated,
+                                           len(self.asteroids), len(self.bullets)),
+            self.spaceship.pack(),
+            GameWorld.RANDOM_STATE.pack(*(state + (gauss is not None, gauss or 0.0))),
+            self.asteroids.pack(),
+            self.bullets.pack(),
+        ])
+
+    def restore(self, blob):
+        # Put the world (and the game's random number generator) back in the
+        # state snapshot() saved, and make it the game's current world again.
+        (magic, width, height, points, justInstantiated,
+         numAsteroids, numBullets) = GameWorld.SNAPSHOT_HEADER.unpack_from(blob)
+        if magic != GameWorld.SNAPSHOT_MAGIC:
+            raise ValueError("not a GameWorld snapshot")
+        if (width, height) != (self.width, self.height):
+            raise ValueError("snapshot of a %dx%d world can't be restored into a %dx%d one"
+                             % (width, height, self.width, self.height))
+        self.points = points
+        self.justInstantiated = justInstantiated
+
+        offset = self.spaceship.unpack(blob, GameWorld.SNAPSHOT_HEADER.size)
+        values = GameWorld.RANDOM_STATE.unpack_from(blob, offset)
+        self.random.setstate((3, values[:-2], values[-1] if values[-2] else None))
+        offset += GameWorld.RANDOM_STATE.size
+
+        offset = self.asteroids.unpack(blob, offset, numAsteroids)
+        self.bullets.unpack(blob, offset, numBullets)
+        self.game.currentWorld = self
+
     def populateAsteroids(self):
         numAsteroids = 5
         for _ in range(numAsteroids):
-            x = random.randint(0,self.surface.get_width())
-            y = random.randint(0,self.surface.get_height())
-
-            size = 30
+            x = self.random.randint(0,self.width)
+            y = self.random.randint(0,self.height)
 
-            self.addAsteroid( Asteroid(self, (x, y), size) )
+            size = GameWorld.MAX_ASTEROID_SIZE
 
-    def addBullet(self,bullet):
-        self.bullets.append(bullet)
-
-    def addAsteroid(self,asteroid):
-        self.asteroids.append(asteroid)
+            Asteroid(self, (x, y), size)
 
     def handleEvents(self, events, actions):
         if self.justInstantiated:
@@ -243,42 +398,122 @@ class GameWorld(object):
             self.spaceship.isShooting = False
 
 
-    def update(self):
-        self.surface.fill(CURRENT_COLOURS["background"])
+    def step(self, dt=TICK):
+        # advance the simulation by dt seconds without touching the surface
+        ticks = dt * TICKS_PER_SECOND
 
-        self.spaceship.update()
+        self.spaceship.step(ticks)
 
-        self.surface.blit(self.scoreFont.render("Current points: "+str(self.points), False, CURRENT_COLOURS["display"]),(20,20))
+        # bullets that have run out of age disappear before they can hit anything
+        self.bullets.compact(self.bullets.age[:len(self.bullets)] > 0)
 
-        for i,v in enumerate(self.spaceship.shape):
-            for j,a in enumerate(self.asteroids):
-                dist = math.sqrt((v[0]+self.spaceship.x-a.x)**2+(v[1]+self.spaceship.y-a.y)**2)
-                if dist < a.size:
-                    #print "YOU LOOOOSE"
-                    self.game.youLose()
+        self.collide()
 
-        for i,b in enumerate(self.bullets):
-            if b.age == 0:
-                self.bullets.remove(b)
-            else:
-                for j,a in enumerate(self.asteroids):
-                    dist = math.sqrt((b.x-a.x)**2+(b.y-a.y)**2)
-                    if dist < a.size: # asteroid hit!!!!
-                        self.bullets.remove(b)
-                        self.points += 10
-                        if a.size > 10:
-                            for x in range(3):
-                                self.addAsteroid(Asteroid(self,(a.x,a.y),a.size/2))
-                        self.asteroids.remove(a)
-                        self.points += 10
-                        break
-                b.update()
-
-        if self.asteroids == [] and not self.easyMode:
+        self.bullets.move(self.width, self.height, ticks)
+        self.bullets.age[:len(self.bullets)] -= ticks
+
+        if len(self.asteroids) == 0 and not self.easyMode:
             self.game.youWin()
         else:
-            for i,x in enumerate(self.asteroids):
-                x.update()
+            self.asteroids.move(self.width, self.height, ticks)
+
+    def draw(self, alpha=1.0):
+        # alpha says how far between the last two simulation steps to draw
+        # things, for smooth motion when rendering slower than simulating.
+        # Returns the rects of the surface that changed (None for all of it).
+        return drawFrame(self.surface, self.game.renderer, self.game.sprites, self.hud,
+                         self.frame(alpha))
+
+    def frame(self, alpha=1.0):
+        # what draw(alpha) would draw, as a Frame
+        x, y = self.spaceship.interpolate(alpha)
+        ship = (int(x), int(y), self.spaceship.heading)
+
+        bullets = asteroids = ((), (), ())
+        n = len(self.bullets)
+        if n:
+            xs, ys = self.bullets.interpolate(alpha, self.width, self.height)
+            angles = np.rint(self.bullets.direction[:n] * (Bullet.SPRITE_ANGLES / TWO_PI)).astype(int) % Bullet.SPRITE_ANGLES
+            bullets = (xs.astype(int).tolist(), ys.astype(int).tolist(), angles.tolist())
+
+        n = len(self.asteroids)
+        if n:
+            xs, ys = self.asteroids.interpolate(alpha, self.width, self.height)
+            asteroids = (xs.astype(int).tolist(), ys.astype(int).tolist(),
+                         self.asteroids.size[:n].tolist())
+
+        return Frame(self.game.worldCount, points=self.points, ship=ship,
+                     bullets=bullets, asteroids=asteroids)
+
+    def collide(self):
+        # Detect every ship-asteroid and bullet-asteroid hit at once from
+        # the arrays in the stores, then resolve the hits afterwards so the
+        # outcome never depends on the order the stores are mutated in.
+        numAsteroids = len(self.asteroids)
+        if numAsteroids == 0:
+            return
+
+        ax = self.asteroids.x[:numAsteroids]
+        ay = self.asteroids.y[:numAsteroids]
+        sizes = self.asteroids.size[:numAsteroids]
+        radii2 = sizes.astype(np.float64) ** 2
+
+        # spaceship vertices against every asteroid
+        shape = self.spaceship.shape
+        dx = (shape[:,0] + self.spaceship.x)[:,np.newaxis] - ax
+        dy = (shape[:,1] + self.spaceship.y)[:,np.newaxis] - ay
+        if (dx*dx + dy*dy < radii2).any():
+            #print "YOU LOOOOSE"
+            self.game.youLose()
+
+        # bullets against the asteroids in the grid cells around them
+        numBullets = len(self.bullets)
+        if numBullets == 0:
+            return
+
+        bx = self.bullets.x[:numBullets]
+        by = self.bullets.y[:numBullets]
+        grid = self.updateAsteroidGrid()
+        bs, as_ = grid.candidatePairs(bx, by, GameWorld.MAX_ASTEROID_SIZE)
+
+        dx = bx[bs] - ax[as_]
+        dy = by[bs] - ay[as_]
+        hit = dx*dx + dy*dy < radii2[as_]
+        bs, as_ = bs[hit], as_[hit]
+        if len(bs) == 0:
+            return
+
+        # each bullet destroys the lowest-numbered asteroid it touches that
+        # an earlier bullet hasn't already destroyed
+        spent = np.zeros(numBullets, dtype=bool)
+        destroyed = np.zeros(numAsteroids, dtype=bool)
+        for k in np.lexsort((as_, bs)):
+            b, a = bs[k], as_[k]
+            if not spent[b] and not destroyed[a]:
+                destroyed[a] = True
+                spent[b] = True
+
+        hitX = ax[destroyed].copy()
+        hitY = ay[destroyed].copy()
+        hitSizes = sizes[destroyed].copy()
+
+        self.bullets.compact(~spent)
+        self.asteroids.compact(~destroyed)
+
+        for x, y, size in zip(hitX, hitY, hitSizes):
+            self.points += 20
+            if size > 10: # asteroid hit!!!! split it up
+                for _ in range(3):
+                    Asteroid(self,(x,y),size/2)
+
+    def updateAsteroidGrid(self):
+        # the grid is only rebuilt when an asteroid has changed since it was
+        # last built
+        if self.asteroidGrid.generation != self.asteroids.generation:
+            n = len(self.asteroids)
+            self.asteroidGrid.rebuild(self.asteroids.x[:n], self.asteroids.y[:n])
+            self.asteroidGrid.generation = self.asteroids.generation
+        return self.asteroidGrid
 
     def sense(self):
         # generate percepts for QuLog or the like
@@ -286,76 +521,143 @@ class GameWorld(object):
         ship_direction = self.spaceship.direction
         speed = myround(self.spaceship.getSpeed(), base=0.1)
 
-        for j,a in enumerate(self.asteroids):
-            dx = a.x - self.spaceship.x
-            dy = a.y - self.spaceship.y
-
-            dist = math.sqrt((dx)**2+(dy)**2)
-
-            asteroid_direction = np.arctan2(dy, dx) % (math.pi * 2)
-            relative_direction = (asteroid_direction - ship_direction) % (math.pi * 2)
+        n = len(self.asteroids)
+        if n <= SpatialGrid.SMALL:
+            # a handful of asteroids are quicker to go through one at a
+            # time than as arrays
+            self.senseFew(percepts, n, ship_direction)
+            percepts.add( ("facing_direction",(ship_direction,)) )
+            percepts.add( ("speed", (speed,)) )
+            return percepts
+
+        # bearings and distances of every nearby asteroid at once; the grid
+        # is only built and consulted when it can rule some of them out
+        if self.asteroidGrid.prunes(GameWorld.VISIBILITY_DISTANCE, n):
+            nearby = self.updateAsteroidGrid().queryRadius(self.spaceship.x, self.spaceship.y,
+                                                           GameWorld.VISIBILITY_DISTANCE)
+        else:
+            nearby = slice(0, n)
+        dx = self.asteroids.x[nearby] - self.spaceship.x
+        dy = self.asteroids.y[nearby] - self.spaceship.y
+        dist, direction_index, _ = GameWorld.seeAsteroids(dx, dy, ship_direction)
 
-            # can the spaceship see the asteroid?
-            if dist > 300 or \
-               (relative_direction > GameWorld.SIDE_THRESHOLD and relative_direction < math.pi * 2 - GameWorld.SIDE_THRESHOLD):
-                # behind / not seen
-                pass
-            else:
-                # then it is seen
-                # translate these pi values into something more human-readable
-                if ( relative_direction <= GameWorld.DEAD_CENTRE_THRESHOLD and relative_direction >= 0) or \
-                    (relative_direction >= math.pi * 2 - GameWorld.DEAD_CENTRE_THRESHOLD and relative_direction < math.pi * 2):
-                    # dead centre
-                    percept_direction = "dead_centre"
-                elif ( relative_direction <= GameWorld.CENTRE_THRESHOLD and relative_direction >= 0) or \
-                    (relative_direction >= math.pi * 2 - GameWorld.CENTRE_THRESHOLD and relative_direction < math.pi * 2):
-                    # centre
-                    percept_direction = "centre"
-                elif relative_direction > GameWorld.CENTRE_THRESHOLD and relative_direction <= GameWorld.SIDE_THRESHOLD:
-                    # right
-                    percept_direction = "right"
-                elif relative_direction < math.pi * 2 - GameWorld.CENTRE_THRESHOLD and relative_direction >= math.pi * 2 - GameWorld.SIDE_THRESHOLD:
-                    # left
-                    percept_direction = "left"
-
-                percepts.add( ("see", ("asteroid", percept_direction, int(dist))) )
-                # add percept
+        for d, k in zip(dist.tolist(), direction_index.tolist()):
+            percepts.add( ("see", ("asteroid", GameWorld.DIRECTION_NAMES[k], d)) )
 
         percepts.add( ("facing_direction",(ship_direction,)) )
         percepts.add( ("speed", (speed,)) )
 
         return percepts
 
+    @staticmethod
+    def seeAsteroids(dx, dy, ship_direction):
+        # For asteroids at offsets (dx, dy) from a ship facing ship_direction
+        # (one direction, or one per asteroid): the whole distances and
+        # DIRECTION_NAMES indices of the ones the ship can see, and a mask
+        # saying which ones those are.
+        # squared with pow, as the original dx**2 was (dx*dx can be an ulp
+        # off), so asteroids right on the visibility distance or a whole
+        # distance come out the same
+        dist = np.sqrt(np.power(dx, 2.0) + np.power(dy, 2.0))
+
+        relative_direction = (np.arctan2(dy, dx) % TWO_PI - ship_direction) % TWO_PI
+        # asteroids more than half a turn clockwise of the ship's heading
+        # are on its left
+        left = relative_direction > math.pi
+
+        # 0: dead centre, 1: centre, 2: to one side, 3: behind / not seen
+        bucket = np.where(left, 3 - np.digitize(relative_direction, GameWorld.LEFT_BINS),
+                          np.digitize(relative_direction, GameWorld.DIRECTION_BINS, right=True))
+        seen = (dist <= GameWorld.VISIBILITY_DISTANCE) & (bucket < 3)
+
+        direction_index = bucket[seen] + ((bucket[seen] == 2) & left[seen])
+        return dist[seen].astype(int), direction_index, seen
+
+    def senseFew(self, percepts, n, ship_direction):
+        # sense()'s see percepts, worked out with the same bins one
+        # asteroid at a time
+        shipX, shipY = self.spaceship.x, self.spaceship.y
+        deadCentre, centre, side = GameWorld.DIRECTION_BINS.tolist()
+        leftSide, leftCentre, leftDeadCentre = GameWorld.LEFT_BINS.tolist()
+        for x, y in zip(self.asteroids.x[:n].tolist(), self.asteroids.y[:n].tolist()):
+            dx = x - shipX
+            dy = y - shipY
+            dist = math.sqrt(dx**2 + dy**2)
+            if dist > GameWorld.VISIBILITY_DISTANCE:
+                continue
+            relative_direction = (math.atan2(dy, dx) % TWO_PI - ship_direction) % TWO_PI
+            if relative_direction > math.pi:
+                if relative_direction >= leftDeadCentre:
+                    k = 0
+                elif relative_direction >= leftCentre:
+                    k = 1
+                elif relative_direction >= leftSide:
+                    k = 3
+                else:
+                    continue
+            elif relative_direction <= deadCentre:
+                k = 0
+            elif relative_direction <= centre:
+                k = 1
+            elif relative_direction <= side:
+                k = 2
+            else:
+                continue
+            percepts.add( ("see", ("asteroid", GameWorld.DIRECTION_NAMES[k], int(dist))) )
+
 
 class Actor(object):
-    def __init__(self,world,(x,y),(speed,direction)):
+    # A lightweight view onto one row of an ActorStore owned by the world,
+    # valid until the store is next compacted. Subclasses name the store
+    # they live in with storeName.
+    __slots__ = ("world", "store", "index")
+    storeName = None
+
+    x = storeColumn("x")
+    y = storeColumn("y")
+    vx = storeColumn("vx")
+    vy = storeColumn("vy")
+    direction = storeColumn("direction")
+
+    def __init__(self,world,(x,y),(speed,direction),size=0,age=0):
         self.world = world
-        self.x = x
-        self.y = y
-
-        self.speed = speed
-        self.direction = direction
-
-        self.vx = self.speed * math.cos(self.direction)
-        self.vy = self.speed * math.sin(self.direction)
-
-    def draw(self):
-        raise NotImplementedError()
+        self.store = getattr(world, self.storeName)
 
-    def update(self):
-        self.move()
-        self.draw()
+        vx = speed * math.cos(direction)
+        vy = speed * math.sin(direction)
+        self.index = self.store.add(x, y, vx, vy, direction, size, age)
 
-    def move(self):
-        self.x = (self.x + self.vx) % self.world.surface.get_width()
-        self.y = (self.y + self.vy) % self.world.surface.get_height()
+    @classmethod
+    def viewOf(cls, world, index):
+        # a view onto a row that is already in the store (e.g. one restored
+        # from a snapshot)
+        view = cls.__new__(cls)
+        view.world = world
+        view.store = getattr(world, cls.storeName)
+        view.index = index
+        return view
 
 
 class Spaceship(object):
+    SHAPE = ((10.0, 10.0), (-10.0, 10.0), (0.0, -20.0))
+    # the ship turns in steps of ROTATION_STEP, so it only ever faces one
+    # of HEADINGS directions: heading k is k steps clockwise of
+    # INITIAL_DIRECTION, and its direction and shape are looked up
+    ROTATION_STEP = math.pi/60
+    HEADINGS = 120
+    INITIAL_DIRECTION = 1.5*math.pi
+    DIRECTIONS, SHAPES = headingTables(SHAPE, ROTATION_STEP, HEADINGS, INITIAL_DIRECTION)
+
+    # x, y, prevX, prevY, vx, vy, rotationDue, shotDue, heading and the
+    # control flags
+    PACKED = struct.Struct("<8dHB")
+    FLAGS = ("isMovingForwards", "isMovingBackwards", "isRotatingClockwise",
+             "isRotatingAntiClockwise", "isShooting")
+
     def __init__(self,world, (x,y)):
         self.world = world
-        self.x = x
-        self.y = y
+        self.x = self.prevX = x
+        self.y = self.prevY = y
 
         self.vx = 0
         self.vy = 0
@@ -363,10 +665,6 @@ class Spaceship(object):
         self.ax = 0
         self.ay = 0
 
-        self.shape =    [[ 10.0 , 10.0],
-                         [-10.0 , 10.0],
-                         [ 0.0  ,-20.0]]
-
         # code for handling translation!
         self.acc = 0.2
         self.isMovingForwards = False
@@ -374,107 +672,248 @@ class Spaceship(object):
         self.decelRatio = 0.97
 
         # code for handling rotation!
-        self.rads = math.pi/60
-        self.direction = 1.5*math.pi
+        self.heading = 0
         self.isRotatingClockwise = False
         self.isRotatingAntiClockwise = False
-        self.clockwiseRotMatrix = [[math.cos(self.rads),-math.sin(self.rads)],
-                              [math.sin(self.rads), math.cos(self.rads)]]
-
-        self.antiClockwiseRotMatrix = [[math.cos(-self.rads),-math.sin(-self.rads)],
-                               [math.sin(-self.rads), math.cos(-self.rads)]]
 
         self.isShooting = False
 
-        self.calcAcceleration()
+        # Turning and shooting happen in whole units (one ROTATION_STEP turn, one
+        # bullet) once per tick. When a step is shorter than a tick these
+        # carry the part of a tick still owed, so the first unit happens
+        # straight away and the rest follow at the tick rate.
+        self.rotationDue = 0.0
+        self.shotDue = 0.0
 
-    def draw(self):
-        pygame.draw.polygon(self.world.surface,CURRENT_COLOURS["spaceship"],translateVectors(self.shape,self.x,self.y),0)
+        self.calcAcceleration()
 
-    def update(self):
-        if self.isRotatingClockwise:
-            self.rotClockwise()
-        elif self.isRotatingAntiClockwise:
-            self.rotAntiClockwise()
+    def pack(self):
+        flags = 0
+        for i, name in enumerate(Spaceship.FLAGS):
+            if getattr(self, name):
+                flags |= 1 << i
+        return Spaceship.PACKED.pack(self.x, self.y, self.prevX, self.prevY,
+                                     self.vx, self.vy, self.rotationDue, self.shotDue,
+                                     self.heading, flags)
+
+    def unpack(self, data, offset):
+        (self.x, self.y, self.prevX, self.prevY, self.vx, self.vy,
+         self.rotationDue, self.shotDue,
+         self.heading, flags) = Spaceship.PACKED.unpack_from(data, offset)
+        for i, name in enumerate(Spaceship.FLAGS):
+            setattr(self, name, bool(flags & (1 << i)))
+        self.calcAcceleration()
+        return offset + Spaceship.PACKED.size
+
+    @property
+    def direction(self):
+        return Spaceship.DIRECTIONS[self.heading]
+
+    @property
+    def shape(self):
+        return Spaceship.SHAPES[self.heading]
+
+    def interpolate(self, alpha):
+        if alpha == 1.0:
+            return self.x, self.y
+        return (wrappedLerp(self.prevX, self.x, alpha, self.world.width),
+                wrappedLerp(self.prevY, self.y, alpha, self.world.height))
+
+    def step(self, ticks=1.0):
+        if self.isRotatingClockwise or self.isRotatingAntiClockwise:
+            self.rotationDue += ticks
+            while self.rotationDue > 1e-9:
+                if self.isRotatingClockwise:
+                    self.rotClockwise()
+                else:
+                    self.rotAntiClockwise()
+                self.rotationDue -= 1
+        else:
+            self.rotationDue = 0.0
 
         if self.isMovingForwards:
-            self.forwardsForce()
+            self.forwardsForce(ticks)
         elif self.isMovingBackwards:
-            self.backwardsForce()
+            self.backwardsForce(ticks)
 
         if self.isShooting:
-            self.shoot()
+            self.shotDue += ticks
+            while self.shotDue > 1e-9:
+                self.shoot()
+                self.shotDue -= 1
+        else:
+            self.shotDue = 0.0
 
-        self.decelerate()
+        self.decelerate(ticks)
 
-        self.move()
-        self.draw()
+        self.move(ticks)
 
     def getSpeed(self):
         return math.sqrt(self.vx * self.vx + self.vy * self.vy)
 
     def rotClockwise(self):
-        self.rotateWithMatrix(self.clockwiseRotMatrix)
-        self.direction = (self.direction + self.rads) % (math.pi * 2)
+        self.heading = (self.heading + 1) % Spaceship.HEADINGS
         self.calcAcceleration()
 
     def rotAntiClockwise(self):
-        self.rotateWithMatrix(self.antiClockwiseRotMatrix)
-        self.direction = (self.direction - self.rads) % (math.pi * 2)
+        self.heading = (self.heading - 1) % Spaceship.HEADINGS
         self.calcAcceleration()
 
     def calcAcceleration(self):
         self.ax = self.acc * math.cos(self.direction)
         self.ay = self.acc * math.sin(self.direction)
 
-    def forwardsForce(self):
-        self.vx += self.ax
-        self.vy += self.ay
+    def forwardsForce(self, ticks=1.0):
+        self.vx += self.ax * ticks
+        self.vy += self.ay * ticks
 
-    def backwardsForce(self):
-        self.vx -= self.ax
-        self.vy -= self.ay
+    def backwardsForce(self, ticks=1.0):
+        self.vx -= self.ax * ticks
+        self.vy -= self.ay * ticks
 
-    def decelerate(self):
-        self.vx = self.vx * self.decelRatio
-        self.vy = self.vy * self.decelRatio
+    def decelerate(self, ticks=1.0):
+        ratio = self.decelRatio ** ticks
+        self.vx = self.vx * ratio
+        self.vy = self.vy * ratio
 
-    def move(self):
-        self.x = (self.x + self.vx) % self.world.surface.get_width()
-        self.y = (self.y + self.vy) % self.world.surface.get_height()
+    def move(self, ticks=1.0):
+        self.prevX, self.prevY = self.x, self.y
+        self.x = (self.x + self.vx * ticks) % self.world.width
+        self.y = (self.y + self.vy * ticks) % self.world.height
 
     def shoot(self):
-        self.world.addBullet(Bullet(self.world,(self.x,self.y),self.direction))
-
-    def rotateWithMatrix(self, matrix):
-        self.shape = [mult2DVecAndMatrix(x,matrix) for x in self.shape]
+        Bullet(self.world,(self.x,self.y),self.direction)
 
 
 class Bullet(Actor):
+    __slots__ = ()
+    storeName = "bullets"
+
     BULLET_AGE = 20
     BULLET_LENGTH = 10
+    # bullets are drawn with the nearest of this many pre-rendered angles
+    SPRITE_ANGLES = 120
 
-    def __init__(self,world,(x,y),direction):
-        super(Bullet,self).__init__(world,(x,y),(18 + random.random() * 2,direction))
+    age = storeColumn("age")
 
-        self.age = Bullet.BULLET_AGE
-        self.length = Bullet.BULLET_LENGTH
+    def __init__(self,world,(x,y),direction):
+        super(Bullet,self).__init__(world,(x,y),(18 + world.random.random() * 2,direction),age=Bullet.BULLET_AGE)
 
-    def draw(self):
-        pygame.draw.line(self.world.surface, CURRENT_COLOURS["bullet"], (self.x,self.y),(self.x + self.length * math.cos(self.direction), self.y + self.length * math.sin(self.direction)))
 
-    def update(self):
-        super(Bullet,self).update()
-        self.age -= 1
+class Asteroid(Actor):
+    __slots__ = ()
+    storeName = "asteroids"
 
+    size = storeColumn("size")
 
-class Asteroid(Actor):
     def __init__(self,world,(x,y),size):
-        super(Asteroid,self).__init__(world,(x,y),(1,random.uniform(0,math.pi*2)))
-        self.size = size
+        super(Asteroid,self).__init__(world,(x,y),(1,world.random.uniform(0,math.pi*2)),size=size)
+
+
+class GameSprites(object):
+    # The sprite atlases everything in a GameWorld is drawn from: one per
+    # ship heading, bullet angle and asteroid size, in the current colours.
+    def __init__(self):
+        self.ship = SpriteAtlas()
+        for heading in range(Spaceship.HEADINGS):
+            self.addShip(heading)
+
+        self.bullets = SpriteAtlas()
+        for k in range(Bullet.SPRITE_ANGLES):
+            self.addBullet(k)
+
+        self.asteroids = SpriteAtlas()
+        size = GameWorld.MAX_ASTEROID_SIZE
+        while size > 0:
+            self.addAsteroid(size)
+            if size <= 10:
+                # too small to split (see GameWorld.collide)
+                break
+            size = size / 2
+
+    def addShip(self, heading):
+        points = Spaceship.SHAPES[heading].tolist()
+        r = int(math.ceil(max(math.hypot(x, y) for x, y in Spaceship.SHAPE))) + 1
+
+        def draw(surface, (ax, ay)):
+            pygame.draw.polygon(surface, CURRENT_COLOURS["spaceship"],
+                                [(ax + x, ay + y) for x, y in points], 0)
+        self.ship.add(heading, (2*r + 1, 2*r + 1), (r, r), draw)
+
+    def addBullet(self, k):
+        angle = k * TWO_PI / Bullet.SPRITE_ANGLES
+        length = Bullet.BULLET_LENGTH
+        r = length + 1
+
+        def draw(surface, (ax, ay)):
+            pygame.draw.line(surface, CURRENT_COLOURS["bullet"], (ax, ay),
+                             (ax + length * math.cos(angle), ay + length * math.sin(angle)))
+        self.bullets.add(k, (2*r + 1, 2*r + 1), (r, r), draw)
+
+    def addAsteroid(self, size):
+        r = int(size)
+
+        def draw(surface, anchor):
+            pygame.draw.circle(surface, CURRENT_COLOURS["asteroid"], anchor, r, 1)
+        self.asteroids.add(size, (2*r + 2, 2*r + 2), (r, r), draw)
+
+    def asteroidSequence(self, sizes, xs, ys):
+        # asteroids of a size there is no sprite for yet get one
+        for size in set(sizes):
+            if size not in self.asteroids:
+                self.addAsteroid(size)
+        return self.asteroids.blitSequence(sizes, xs, ys)
+
+class Frame(object):
+    # Everything needed to draw a world at one moment, copied out of it so
+    # that it can be drawn while the simulation carries on: the ship's
+    # position and heading, the positions, angles and sizes of the bullets
+    # and asteroids, and the points. A title screen's frame is just its
+    # title. world is the Game.worldCount of the world it is a frame of.
+    # Frames aren't changed once made.
+    __slots__ = ("world", "title", "points", "ship", "bullets", "asteroids")
+
+    def __init__(self, world, title=None, points=0, ship=None,
+                 bullets=((), (), ()), asteroids=((), (), ())):
+        self.world = world
+        self.title = title
+        self.points = points
+        # (x, y, heading)
+        self.ship = ship
+        # (xs, ys, angle indices) and (xs, ys, sizes)
+        self.bullets = bullets
+        self.asteroids = asteroids
 
-    def draw(self):
-        pygame.draw.circle(self.world.surface, CURRENT_COLOURS["asteroid"], (int(self.x),int(self.y)),self.size,1)
+def drawFrame(surface, renderer, sprites, hud, frame):
+    # Draw a GameWorld's frame. Everything is a pre-rendered sprite, so
+    # each kind of actor is drawn with a single blits call. Returns the
+    # rects of the surface that changed (None for all of it).
+    renderer.begin()
+
+    x, y, heading = frame.ship
+    sprite, (dx, dy) = sprites.ship[heading]
+    renderer.add(surface.blit(sprite, (x + dx, y + dy)))
+
+    renderer.add(hud.draw(surface, frame.points))
+
+    xs, ys, angles = frame.bullets
+    if xs:
+        renderer.extend(surface.blits(sprites.bullets.blitSequence(angles, xs, ys)))
+
+    xs, ys, sizes = frame.asteroids
+    if xs:
+        renderer.extend(surface.blits(sprites.asteroidSequence(sizes, xs, ys)))
+
+    return renderer.end()
+
+_sprites = None
+
+def getSprites():
+    # the sprites are only rendered once per process
+    global _sprites
+    if _sprites is None:
+        _sprites = GameSprites()
+    return _sprites
 
 
 DELAY = 500
@@ -508,35 +947,197 @@ class MessageThread(threading.Thread):
         self.running = False
 
 
-def send_message(client, addr, percept_text):
+# Draws the frames the main loop publishes, so that a slow display holds
+# up neither the simulation nor the agent. It is the only thing that
+# touches the window's surface: the game itself is run without one.
+class RenderThread(threading.Thread):
+    def __init__(self, surface, frames, frameRate=FRAMES_PER_SECOND):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.surface = surface
+        self.frames = frames
+        self.frameRate = frameRate
+        self.drawn = 0
+
+        # made here, in the main thread, which owns the display
+        self.renderer = DirtyRectRenderer(surface, CURRENT_COLOURS["background"])
+        self.sprites = getSprites()
+        self.hud = ScoreHud(getFont(None, 18), CURRENT_COLOURS["display"], (20,20))
+        self.titleFont = getFont(None, 36)
+
+    def run(self):
+        clock = pygame.time.Clock()
+        world = None
+        while True:
+            frame = self.frames.take()
+            if frame is None:
+                break
+
+            if frame.world != world:
+                world = frame.world
+                self.renderer.invalidate()
+                if frame.title is not None:
+                    self.surface.blit(textCache.render(self.titleFont, frame.title,
+                                                       CURRENT_COLOURS["display"]), (200,200))
+                    self.renderer.present(None)
+            if frame.title is not None:
+                # nothing changes once the title is up
+                continue
+
+            self.renderer.present(drawFrame(self.surface, self.renderer, self.sprites,
+                                            self.hud, frame))
+            self.drawn += 1
+            clock.tick(self.frameRate)
+
+    def stop(self):
+        # wait for the frame being drawn (if any) and stop
+        self.frames.close()
+        if self.is_alive():
+            self.join()
+
+
+class ControlMetrics(object):
+    # How far behind the agent's control messages are. Each frame every
+    # waiting message is taken at once; depth is how many there were and
+    # age how long the oldest of them had been waiting (in seconds). The
+    # maxima cover the frames since the last reset().
+    def __init__(self):
+        self.messages = 0
+        self.depth = 0
+        self.age = 0.0
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.maxDepth = 0
+        self.maxAge = 0.0
+
+    def record(self, messages):
+        # messages are the (term, rock, age) triples from client.get_terms()
+        self.frames += 1
+        self.messages += len(messages)
+        self.depth = len(messages)
+        self.age = max([age for _, _, age in messages]) if messages else 0.0
+        self.maxDepth = max(self.maxDepth, self.depth)
+        self.maxAge = max(self.maxAge, self.age)
+
+    def summary(self):
+        return "control messages: %d total, max depth %d, max age %.1fms over %d frames" % (
+            self.messages, self.maxDepth, self.maxAge * 1000, self.frames)
+
+def netControls(controls, net):
+    # Record the start_/stop_ actions in the list term of a controls
+    # message in net (action name -> True to start, False to stop); a later
+    # start_ or stop_ of the same action overrides an earlier one.
+    if type(controls) == pedroclient.PList:
+        for action in controls.toList():
+            functor = str(action.functor)
+            if functor == 'start_':
+                net[str(action.args[0])] = True
+            elif functor == 'stop_':
+                net[str(action.args[0])] = False
+    elif type(controls) == pedroclient.PAtom:
+        pass
+    else:
+        raise Exception("invalid message received")
+
+def illegal_percepts(message):
+    print "Illegal percepts message"
+
+def send_message(client, addr, percept_term):
     if addr is None:
 #        print "No agent connected"
         pass
     else:
         # send percepts
-        if client.p2p(addr, percept_text) == 0:
+        if client.p2p(addr, percept_term) == 0:
             print "Illegal percepts message"
 
-def main(using_pedro=False, shell_name="asteroids"):
-    pygame.init()
+def stepGame(game, actions, dt, recorder=None):
+    # one simulation step, logged to recorder (if there is one) first
+    if recorder is not None:
+        recorder.record(actions)
+        if "quit" in actions:
+            # handleActions is about to exit the process
+            recorder.close()
+    game.currentWorld.handleActions(actions)
+    game.currentWorld.step(dt)
+
+def replay(path):
+    # Re-run a recorded session headless and as fast as possible. A
+    # recorded quit ends the replay. Returns the game and the number of
+    # steps run.
+    recording = Recording(path)
+    game = Game(None, easyMode=recording.easyMode, splashScreen=recording.splashScreen,
+                size=recording.size, seed=recording.seed)
+    steps = 0
+    for actions in recording:
+        if "quit" in actions:
+            break
+        game.currentWorld.handleActions(actions)
+        game.currentWorld.step(recording.dt)
+        steps += 1
+    return game, steps
+
+def main(using_pedro=False, shell_name="asteroids", headless=False, max_frames=None,
+         size=(WORLD_WIDTH,WORLD_HEIGHT), simulation_rate=TICKS_PER_SECOND,
+         frame_rate=FRAMES_PER_SECOND, interpolate=False, delta_percepts=False,
+         snapshot_interval=50, control_metrics=False, seed=None, record=None,
+         render_thread=False):
+    # In headless mode no window is opened, nothing is drawn and the loop
+    # isn't throttled: the world is simulated as fast as the CPU allows.
+    #
+    # Otherwise the simulation advances in fixed steps of 1/simulation_rate
+    # seconds, as many per rendered frame as real time calls for, so slow
+    # frames don't change the game's dynamics. With interpolate the frame is
+    # drawn between the last two steps rather than at the latest one.
+    #
+    # With record, the seed and the actions of every step are saved to that
+    # file, for replay().
+    #
+    # With render_thread the loop only publishes a Frame of the world each
+    # time round, and a RenderThread draws them.
+    dt = 1.0 / simulation_rate
+
+    if headless:
+        windowSurfObj = None
+    else:
+        pygame.init()
+
+        fpsClock = pygame.time.Clock()
+
+        windowSurfObj = pygame.display.set_mode(size)
+
+        pygame.display.set_caption("Asteroids")
 
-    fpsClock = pygame.time.Clock()
+        windowSurfObj.fill(CURRENT_COLOURS['background'])
 
-    width, height = 640, 480
-    windowSurfObj = pygame.display.set_mode((width,height))
+    splashScreen = not using_pedro and not headless
 
-    pygame.display.set_caption("Asteroids")
+    if record is not None and seed is None:
+        seed = random.SystemRandom().randrange(2**62)
 
-    windowSurfObj.fill(CURRENT_COLOURS['background'])
+    renderThread = None
+    gameSurface = windowSurfObj
+    if render_thread and not headless:
+        frames = FrameBuffer()
+        renderThread = RenderThread(windowSurfObj, frames, frame_rate)
+        renderThread.start()
+        gameSurface = None
 
-    splashScreen = not using_pedro
+    game = Game(gameSurface,easyMode=False, splashScreen=splashScreen, size=size, seed=seed)
 
-    game = Game(windowSurfObj,easyMode=False, splashScreen=splashScreen)
+    recorder = None
+    if record is not None:
+        recorder = Recorder(record, seed, size, dt, splashScreen=splashScreen)
 
     percepts = set()
 
     if using_pedro:
-        client = pedroclient.PedroClient()
+        # percepts are published pipelined, so the game never waits for
+        # the server to ack them
+        client = pedroclient.PedroClient(pipelined=True, ack_callback=illegal_percepts,
+                                         parse_cache_size=64)
         c = client.register(shell_name)
         print "registered?  "+ str(c)
     
@@ -544,9 +1145,20 @@ def main(using_pedro=False, shell_name="asteroids"):
 
         percept_actions = set()
 
+        if delta_percepts:
+            differ = PerceptDiffer(snapshot_interval)
+
+        metrics = ControlMetrics()
+
     user_actions = set()
 
-    while True:
+    accumulator = 0.0
+    last_time = time.time()
+
+    frame = 0
+    while max_frames is None or frame < max_frames:
+        frame += 1
+
         if type(game.currentWorld) is GameWorld:
             user_actions.discard("start_game")
 
@@ -555,38 +1167,52 @@ def main(using_pedro=False, shell_name="asteroids"):
             new_percepts = game.currentWorld.sense()
             percepts = new_percepts
             
-            percept_string = "[" + ",".join(map(format_percept, percepts)) + "]"
-            #print percept_string
-            send_message(client, tr_client_addr, percept_string)
-
-            if client.notification_ready():
-                m = client.get_term()
-                p2pmsg = m[0]
+            if delta_percepts:
+                percept_term = differ.message(percepts)
+            else:
+                percept_term = percepts
+            #print format_percepts(percepts)
+            if tr_client_addr is not None and not client.connected:
+                print "Lost the connection to Pedro"
+                tr_client_addr = None
+            if percept_term is not None:
+                send_message(client, tr_client_addr, percept_term)
+
+            # take every message that has arrived, so a burst from the
+            # agent is dealt with now rather than one message per frame,
+            # and apply only the net effect of its start_s and stop_s
+            messages = client.get_terms()
+            metrics.record(messages)
+            net = {}
+            for p2pmsg, _, _ in messages:
                 message = p2pmsg.args[2]
                 if str(message) == 'initialise_':
                     # get the sender address
                     percepts_addr = p2pmsg.args[1]
                     tr_client_addr = percepts_addr
                     percept_actions = set()
+                    net = {}
+                    if delta_percepts:
+                        differ.reset()
 
                 elif str(message.functor) == 'controls': # was sent actions to perform
-                    r = message.args[0]
-                    
-                    if type(r) == pedroclient.PList:
-                        rec_actions = r.toList()
-                        for action in rec_actions:
-                            a = str(action.args[0])
-
-                            if str(action.functor) == 'start_':
-                                percept_actions.add(a)
-                            elif str(action.functor) == 'stop_':
-                                percept_actions.discard(a)
-                    elif type(r) == pedroclient.PAtom:
-                        pass
-                    else:
-                        raise Exception("invalid message received")
-
-        user_actions = game.currentWorld.handleEvents(pygame.event.get(), user_actions)
+                    netControls(message.args[0], net)
+
+            for a, started in net.iteritems():
+                if started:
+                    percept_actions.add(a)
+                else:
+                    percept_actions.discard(a)
+
+            if control_metrics and metrics.frames >= frame_rate:
+                print metrics.summary()
+                metrics.reset()
+
+        if headless:
+            events = []
+        else:
+            events = pygame.event.get()
+        user_actions = game.currentWorld.handleEvents(events, user_actions)
 
         if "clear" in user_actions:
             percept_actions = set()
@@ -596,10 +1222,35 @@ def main(using_pedro=False, shell_name="asteroids"):
         else:
             actions = user_actions
 
-        game.currentWorld.handleActions(actions)
-        game.currentWorld.update()
-        pygame.display.update()
-        fpsClock.tick(FRAMES_PER_SECOND)
+        if headless:
+            stepGame(game, actions, dt, recorder)
+        else:
+            now = time.time()
+            accumulator += min(now - last_time, MAX_FRAME_TIME)
+            last_time = now
+
+            while accumulator >= dt:
+                if renderThread is not None and "quit" in actions:
+                    # the display is about to be closed under it
+                    renderThread.stop()
+                stepGame(game, actions, dt, recorder)
+                accumulator -= dt
+
+            alpha = accumulator / dt if interpolate else 1.0
+            if renderThread is not None:
+                worldFrame = game.currentWorld.frame(alpha)
+                if worldFrame is not None:
+                    frames.publish(worldFrame)
+            else:
+                game.renderer.present(game.currentWorld.draw(alpha))
+            fpsClock.tick(frame_rate)
+
+    if renderThread is not None:
+        renderThread.stop()
+    if recorder is not None:
+        recorder.close()
+
+    return game
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="An Asteroids game.")
@@ -609,7 +1260,53 @@ if __name__ == '__main__':
                         to play this game automatically.')
     parser.add_argument('--shell', dest='shell',
                         help='the name of the shell to use with Pedro')
+    parser.add_argument('--delta-percepts', dest='delta_percepts', action='store_true',
+                        help='send the agent only the percepts that changed since the \
+                        last message, with a full snapshot every --snapshot-interval frames.')
+    parser.add_argument('--snapshot-interval', dest='snapshot_interval', type=int, default=50,
+                        help='frames between full percept snapshots with --delta-percepts.')
+    parser.add_argument('--control-metrics', dest='control_metrics', action='store_true',
+                        help='print how many agent control messages were waiting each \
+                        frame, and for how long, about once a second.')
+    parser.add_argument('--seed', dest='seed', type=int,
+                        help='seed the game\'s random numbers, to play the same game again.')
+    parser.add_argument('--record', dest='record', metavar='FILE',
+                        help='record the session to FILE so that it can be replayed.')
+    parser.add_argument('--replay', dest='replay', metavar='FILE',
+                        help='replay the session recorded in FILE headless, as fast as \
+                        possible, and report how long it took.')
+    parser.add_argument('--headless', dest='headless', action='store_true',
+                        help='run the simulation without opening a window or drawing \
+                        anything, as fast as possible.')
+    parser.add_argument('--frames', dest='frames', type=int,
+                        help='stop after this many frames.')
+    parser.add_argument('--sim-rate', dest='sim_rate', type=float, default=TICKS_PER_SECOND,
+                        help='how many simulation steps to run per second.')
+    parser.add_argument('--fps', dest='fps', type=int, default=FRAMES_PER_SECOND,
+                        help='how many frames to draw per second.')
+    parser.add_argument('--interpolate', dest='interpolate', action='store_true',
+                        help='draw positions interpolated between simulation steps.')
+    parser.add_argument('--render-thread', dest='render_thread', action='store_true',
+                        help='draw in a separate thread, so that slow drawing doesn\'t \
+                        hold up the simulation or the agent.')
+    parser.add_argument('--width', dest='width', type=int, default=WORLD_WIDTH,
+                        help='the width of the world in pixels.')
+    parser.add_argument('--height', dest='height', type=int, default=WORLD_HEIGHT,
+                        help='the height of the world in pixels.')
 
     args = parser.parse_args()
 
-    main(using_pedro=args.pedro, shell_name=args.shell)
+    if args.replay is not None:
+        start = time.time()
+        game, steps = replay(args.replay)
+        elapsed = time.time() - start
+        print "replayed %d steps in %.3fs (%.0f steps/s), %d points" % (
+            steps, elapsed, steps / max(elapsed, 1e-9), getattr(game.currentWorld, "points", 0))
+        sys.exit()
+
+    main(using_pedro=args.pedro, shell_name=args.shell, headless=args.headless,
+         max_frames=args.frames, size=(args.width, args.height),
+         simulation_rate=args.sim_rate, frame_rate=args.fps, interpolate=args.interpolate,
+         delta_percepts=args.delta_percepts, snapshot_interval=args.snapshot_interval,
+         control_metrics=args.control_metrics, seed=args.seed, record=args.record,
+         render_thread=args.render_thread)
@@ -0,0 +1,105 @@
+# Run many independent headless games side by side in one process.
+#
+# Every environment is an ordinary Game with no surface and no splash
+# screens, stepped in lockstep through the same handleActions/step/sense
+# cycle that main() uses. When a game is won or lost the Game replaces its
+# world with a fresh one, so environments reset themselves.
+#
+# Each world keeps its own actor stores, so stepping is still one
+# handleActions/step (with its own vectorised move and collide) per
+# environment. Sensing is done for the whole batch at once: the asteroids
+# of every world go through one set of array operations.
+
+import numpy as np
+
+from asteroids import Game, GameWorld, TICK, WORLD_WIDTH, WORLD_HEIGHT, myround
+
+
+class BatchEnv(object):
+    # With a seed, environment i is seeded with seed + i (and again on each
+    # reset), so a batch plays out the same way every time.
+    def __init__(self, numEnvs, easyMode=False, size=(WORLD_WIDTH,WORLD_HEIGHT), dt=TICK, seed=None):
+        self.numEnvs = numEnvs
+        self.easyMode = easyMode
+        self.size = size
+        self.dt = dt
+        self.seed = seed
+
+        self.games = [self.newGame(i) for i in range(numEnvs)]
+        self.steps = np.zeros(numEnvs, dtype=np.int64)
+
+    def newGame(self, i):
+        seed = None if self.seed is None else self.seed + i
+        return Game(None, easyMode=self.easyMode, splashScreen=False, size=self.size, seed=seed)
+
+    def __len__(self):
+        return self.numEnvs
+
+    @property
+    def worlds(self):
+        return [game.currentWorld for game in self.games]
+
+    def reset(self):
+        self.games = [self.newGame(i) for i in range(self.numEnvs)]
+        self.steps[:] = 0
+        return self.sense()
+
+    def sense(self):
+        # the percepts GameWorld.sense gives for each environment
+        worlds = self.worlds
+        ships = [world.spaceship for world in worlds]
+        counts = [len(world.asteroids) for world in worlds]
+        directions = [ship.direction for ship in ships]
+
+        percepts = [set([("facing_direction", (direction,)),
+                         ("speed", (myround(ship.getSpeed(), base=0.1),))])
+                    for ship, direction in zip(ships, directions)]
+        if sum(counts) == 0:
+            return percepts
+
+        # every asteroid of every world, with its own world's ship
+        x = np.concatenate([world.asteroids.x[:n] for world, n in zip(worlds, counts)])
+        y = np.concatenate([world.asteroids.y[:n] for world, n in zip(worlds, counts)])
+        shipX = np.repeat([ship.x for ship in ships], counts)
+        shipY = np.repeat([ship.y for ship in ships], counts)
+        env = np.repeat(np.arange(self.numEnvs), counts)
+
+        dist, index, seen = GameWorld.seeAsteroids(x - shipX, y - shipY,
+                                                   np.repeat(directions, counts))
+        names = GameWorld.DIRECTION_NAMES
+        for e, d, k in zip(env[seen].tolist(), dist.tolist(), index.tolist()):
+            percepts[e].add( ("see", ("asteroid", names[k], d)) )
+        return percepts
+
+    def step(self, actions):
+        # actions holds one set of action names per environment (None for no
+        # actions). Returns per-environment percepts, the points scored
+        # during the step and whether the episode ended (and was reset).
+        if len(actions) != self.numEnvs:
+            raise ValueError("expected %d action sets, got %d" % (self.numEnvs, len(actions)))
+
+        rewards = np.zeros(self.numEnvs, dtype=np.int64)
+        dones = np.zeros(self.numEnvs, dtype=bool)
+        noActions = frozenset()
+
+        for i, game in enumerate(self.games):
+            world = game.currentWorld
+            envActions = actions[i]
+            if envActions is None:
+                envActions = noActions
+            elif "quit" in envActions:
+                # a single environment mustn't take the whole process down
+                envActions = set(envActions) - set(["quit"])
+
+            points = world.points
+            world.handleActions(envActions)
+            world.step(self.dt)
+
+            rewards[i] = world.points - points
+            if game.currentWorld is not world:
+                dones[i] = True
+                self.steps[i] = 0
+            else:
+                self.steps[i] += 1
+
+        return self.sense(), rewards, dones
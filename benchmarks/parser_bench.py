@@ -0,0 +1,63 @@
+# Micro-benchmark for pedroclient.PedroParser: how many terms per second it
+# parses for the kinds of message the game gets from a teleo-reactive agent,
+# next to the original parser (checks/reference_parser.py).
+#
+#   python benchmarks/parser_bench.py [seconds-per-payload]
+
+import os
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, os.pardir))
+sys.path.insert(0, os.path.join(here, os.pardir, "checks"))
+
+import pedroclient
+import reference_parser
+
+
+ADDRESSES = "asteroids@'localhost', thingy:tr@'localhost', "
+
+PAYLOADS = [
+    ("controls",
+     "p2pmsg(" + ADDRESSES + "controls([start_(turn_left), stop_(shoot)]))"),
+    ("controls_long",
+     "p2pmsg(" + ADDRESSES + "controls([" +
+     ", ".join("start_(%s), stop_(%s)" % (a, b) for a, b in
+               [("turn_left", "turn_right"), ("move_forward", "move_backward"),
+                ("shoot", "turn_left"), ("turn_right", "shoot")] * 3) +
+     "]))"),
+    ("initialise",
+     "p2pmsg(" + ADDRESSES + "initialise_)"),
+    ("operators",
+     "p2pmsg(" + ADDRESSES + "f(X, -3, 4.5e3, \"a \\\"string\\\"\", [a, b|T], "
+     "(a, b ; c -> d), 1 + 2 * 3 - 4 mod 5, X = Y, 'Quoted atom'))"),
+]
+
+
+def terms_per_second(module, text, seconds):
+    parser = module.PedroParser()
+    parse = parser.parse
+    count = 0
+    start = time.time()
+    elapsed = 0.0
+    while elapsed < seconds:
+        for _ in xrange(100):
+            parse(text)
+        count += 100
+        elapsed = time.time() - start
+    return count / elapsed
+
+
+def run(seconds=1.0):
+    # (name, original parser's rate, current parser's rate) for each payload
+    return [(name, terms_per_second(reference_parser, text, seconds),
+             terms_per_second(pedroclient, text, seconds))
+            for name, text in PAYLOADS]
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    print "%-16s %12s %12s %8s" % ("terms/s", "original", "current", "speedup")
+    for name, before, after in run(seconds):
+        print "%-16s %12.0f %12.0f %7.2fx" % (name, before, after, after / before)
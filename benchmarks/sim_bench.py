@@ -0,0 +1,239 @@
+# Benchmarks for the headless simulation: steps per second, where the time
+# goes and how much memory each scenario needs.
+#
+#   python benchmarks/sim_bench.py [--steps N] [--no-render] [--json FILE] [scenario ...]
+#
+# Every scenario plays a seeded game with a seeded policy, so repeated runs
+# do exactly the same work. A step here is what a frame of the game in
+# Pedro mode does: handleActions and step, then sense the world and write
+# the percepts out as a Pedro message, then (unless --no-render) draw the
+# world onto an offscreen surface. The time of each phase is measured by
+# wrapping the methods that do the work, so the game itself is unchanged.
+#
+# Each scenario runs in a process of its own, so its peak memory (the
+# process's ru_maxrss) isn't inflated by whatever ran before it.
+
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from timeit import default_timer as clock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import numpy as np
+import pygame
+
+import pedroclient
+from asteroids import Game, GameWorld, Asteroid, TICK
+from farm import policySeed
+
+
+PHASES = ("move", "collide", "sense", "percepts", "render")
+
+# asteroids are never placed closer than this to the ship, so that crowded
+# scenarios don't end the moment they start
+SAFE_DISTANCE = 80
+
+
+def addAsteroids(world, count, minDistance, maxDistance):
+    # count full-size asteroids between minDistance and maxDistance of the
+    # ship, measured the short way round the wrap-around world
+    rng = world.random
+    shipX, shipY = world.spaceship.x, world.spaceship.y
+    added = 0
+    while added < count:
+        x = rng.uniform(0, world.width)
+        y = rng.uniform(0, world.height)
+        dx = abs(x - shipX)
+        dy = abs(y - shipY)
+        distance = math.hypot(min(dx, world.width - dx), min(dy, world.height - dy))
+        if minDistance <= distance <= maxDistance:
+            Asteroid(world, (x, y), GameWorld.MAX_ASTEROID_SIZE)
+            added += 1
+
+
+def defaultSetup(world):
+    pass
+
+def swarmSetup(world):
+    world.asteroids.clear()
+    addAsteroids(world, 500, SAFE_DISTANCE, world.width + world.height)
+
+def cascadeSetup(world):
+    # a ring of big asteroids close enough for a spinning, firing ship to
+    # hit nearly all of them, so they keep splitting
+    world.asteroids.clear()
+    addAsteroids(world, 100, SAFE_DISTANCE, 2 * SAFE_DISTANCE)
+
+
+def randomPolicy(rng):
+    return set(a for a in ("turn_left", "turn_right", "move_forward", "shoot")
+               if rng.random() < 0.3)
+
+def firePolicy(rng):
+    return set(["shoot", "turn_left"])
+
+
+# name -> (what to do to every new world, how to choose actions)
+SCENARIOS = [
+    ("default", defaultSetup, randomPolicy),
+    ("swarm500", swarmSetup, randomPolicy),
+    ("continuous_fire", defaultSetup, firePolicy),
+    ("split_cascade", cascadeSetup, firePolicy),
+]
+
+
+class PhaseTimer(object):
+    def __init__(self):
+        self.totals = dict((phase, 0.0) for phase in PHASES)
+
+    def wrap(self, obj, method, phase):
+        # time every call of obj.method as part of phase
+        original = getattr(obj, method)
+        totals = self.totals
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                totals[phase] += clock() - start
+
+        setattr(obj, method, timed)
+
+    def instrument(self, world):
+        self.wrap(world.spaceship, "step", "move")
+        self.wrap(world.asteroids, "move", "move")
+        self.wrap(world.bullets, "move", "move")
+        self.wrap(world, "collide", "collide")
+        self.wrap(world, "sense", "sense")
+        self.wrap(world, "draw", "render")
+
+
+def runScenario(name, steps, seed, render):
+    _, setup, policy = [s for s in SCENARIOS if s[0] == name][0]
+
+    surface = None
+    if render:
+        pygame.font.init()
+        surface = pygame.Surface((640, 480))
+
+    game = Game(surface, splashScreen=False, seed=seed)
+    policyRng = random.Random(policySeed(seed))
+    writer = pedroclient.TermWriter()
+    timer = PhaseTimer()
+
+    world = None
+    resets = 0
+    maxAsteroids = 0
+    start = clock()
+    for _ in xrange(steps):
+        if game.currentWorld is not world:
+            if world is not None:
+                resets += 1
+            world = game.currentWorld
+            setup(world)
+            timer.instrument(world)
+
+        world.handleActions(policy(policyRng))
+        world.step(TICK)
+
+        percepts = world.sense()
+        t = clock()
+        writer.reset()
+        writer.write(percepts)
+        timer.totals["percepts"] += clock() - t
+
+        if render:
+            world.draw()
+        maxAsteroids = max(maxAsteroids, len(world.asteroids))
+    elapsed = clock() - start
+
+    return {
+        "scenario": name,
+        "seed": seed,
+        "steps": steps,
+        "seconds": elapsed,
+        "steps_per_second": steps / elapsed,
+        "phase_seconds": timer.totals,
+        "phase_us_per_step": dict((phase, 1e6 * total / steps)
+                                  for phase, total in timer.totals.items()),
+        "resets": resets,
+        "max_asteroids": maxAsteroids,
+        # kilobytes on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _runInChild(results, name, steps, seed, render):
+    results.put(runScenario(name, steps, seed, render))
+
+def run(names=None, steps=2000, seed=0, render=True):
+    # run the named scenarios (all of them by default), each in a fresh
+    # process, and return their results
+    if names is None:
+        names = [s[0] for s in SCENARIOS]
+    results = []
+    for name in names:
+        queue = multiprocessing.Queue()
+        p = multiprocessing.Process(target=_runInChild, args=(queue, name, steps, seed, render))
+        p.start()
+        results.append(queue.get())
+        p.join()
+    return results
+
+
+def report(results):
+    print "%-16s %10s %6s %6s   %s" % ("scenario", "steps/s", "resets", "max",
+                                      "  ".join("%8s" % p for p in PHASES) + "  (us/step)   peak RSS")
+    for r in results:
+        print "%-16s %10.0f %6d %6d   %s  %8.1f MB" % (
+            r["scenario"], r["steps_per_second"], r["resets"], r["max_asteroids"],
+            "  ".join("%8.1f" % r["phase_us_per_step"][p] for p in PHASES),
+            r["peak_rss_kb"] / 1024.0)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the headless simulation.")
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help='scenarios to run (default: all of %s)'
+                        % ", ".join(s[0] for s in SCENARIOS))
+    parser.add_argument('--steps', type=int, default=2000,
+                        help='simulation steps per scenario.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the games and the policies.')
+    parser.add_argument('--no-render', dest='render', action='store_false',
+                        help='skip drawing, e.g. to time only the simulation.')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the results to FILE as JSON.')
+    args = parser.parse_args()
+
+    known = [s[0] for s in SCENARIOS]
+    for name in args.scenarios:
+        if name not in known:
+            parser.error("unknown scenario %s" % name)
+
+    results = run(args.scenarios or None, args.steps, args.seed, args.render)
+    report(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "time": time.time(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "pygame": pygame.version.ver,
+                "platform": platform.platform(),
+                "steps": args.steps,
+                "seed": args.seed,
+                "render": args.render,
+                "results": results,
+            }, f, indent=2, sort_keys=True)
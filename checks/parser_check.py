@@ -0,0 +1,93 @@
+# Check that pedroclient.PedroParser still parses exactly like the original
+# parser (kept in reference_parser.py): the same term, or a ParseError for
+# both, for a fixed set of tricky inputs, the parser benchmark's messages
+# and a seeded stream of random token strings.
+#
+#   python checks/parser_check.py [--count N] [--seed S]
+#
+# Exits with status 1 if any input parses differently.
+
+import os
+import random
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, os.pardir))
+sys.path.insert(0, os.path.join(here, os.pardir, "benchmarks"))
+
+import pedroclient
+import reference_parser
+from parser_bench import PAYLOADS
+
+
+CASES = [
+    "a", "[]", "{}", "f(a)", "-1", "- 1", "-(1)", "-a", "- 2.5e3", "a:b", "a:b@c", "a@b:c", "a:b@c:d",
+    "1+2+3", "1-2-3", "1*2+3*4", "a = b", "a=b,c=d", "(a,b,c)", "a->b->c", "a;b;c", "a,b->c;d",
+    "2**3", "- 2 ** 3", "X is Y + 1", "[a|b]", "[a,b|[c]]", "f([1,2,3],\"s\\\\n\")", "'it''s'",
+    "'a\\\\'b'", "a << b >> c", "a // b / c", "x \\/ y /\\ z", "a >= b", "a =< b", "f(-)", "f(- , a)",
+    "- - 1", "-(-(1))", "a =b", "[ ]", "f( a , b )", "  x  ", "p2pmsg(a@b, c:d@'h', initialise_)",
+    "1.5", "1e5", "12", "A_b", "f(a)(b)", "a b", "f(", "[a", "(a", "a:", "", ")", "a = b = c",
+    "2 ** 3 ** 4", "-1 ** 2", "a:b:c", "a@b@c", "-(3) * 2", "- 3 * 2", "a - -1", "f(a, (b, c))",
+    "[a, (b, c)]", "'[]'", "\"\"", "f(X, _)",
+]
+
+# what the random inputs are made of
+TOKENS = ['a', 'b', 'X', '1', '2.5', '-', '+', '*', '**', ':', '@', '=', 'is', 'mod', ',', ';',
+          '->', '(', ')', '[', ']', '|', '"s"', "'q'", ' ', 'f(', '%', '{}', '//', '<<', '=<']
+
+
+def dump(term):
+    # a term as nested tuples, which don't depend on the classes of either module
+    kind = term.get_type()
+    if kind == pedroclient.PObject.listtype:
+        return ('list', dump(term.head), dump(term.tail))
+    if kind == pedroclient.PObject.structtype:
+        return ('struct', dump(term.functor), tuple(dump(a) for a in term.args))
+    return (kind, term.val)
+
+def parsed(module, text):
+    try:
+        return dump(module.PedroParser().parse(text))
+    except module.ParseError:
+        return 'ParseError'
+    except RuntimeError:
+        # too deeply nested for the recursive reference parser
+        return 'RuntimeError'
+
+def randomInputs(count, seed):
+    rng = random.Random(seed)
+    for _ in xrange(count):
+        yield ''.join(rng.choice(TOKENS) for _ in range(rng.randint(1, 9)))
+
+
+def check(inputs):
+    # returns (number of inputs, number that parsed, mismatches)
+    total = terms = 0
+    mismatches = []
+    for text in inputs:
+        expected = parsed(reference_parser, text)
+        actual = parsed(pedroclient, text)
+        total += 1
+        if expected != actual:
+            mismatches.append((text, expected, actual))
+        elif not isinstance(expected, str):
+            terms += 1
+    return total, terms, mismatches
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check PedroParser against the original parser.")
+    parser.add_argument('--count', type=int, default=200000,
+                        help='how many random token strings to parse.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the random token strings.')
+    args = parser.parse_args()
+
+    inputs = CASES + [text for _, text in PAYLOADS]
+    total, terms, mismatches = check(inputs + list(randomInputs(args.count, args.seed)))
+    for text, expected, actual in mismatches[:20]:
+        print "MISMATCH %r\n  expected %r\n  got      %r" % (text, expected, actual)
+    print "%d inputs (%d terms), %d mismatches" % (total, terms, len(mismatches))
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,116 @@
+# Check that recorded sessions replay exactly: scripted headless sessions
+# are recorded, replayed with asteroids.replay() and the final worlds
+# compared byte for byte (by their snapshots). Also checks that runs
+# longer than a run record can hold, the header fields and unreadable
+# files are dealt with.
+#
+#   python checks/recording_check.py [--steps N] [--seed S]
+#
+# Exits with status 1 if anything doesn't match.
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import asteroids
+import recording
+from asteroids import Game, GameWorld, TICK, WORLD_WIDTH, WORLD_HEIGHT
+
+
+def scriptedActions(rng, splashScreen):
+    # a new random set of actions every 37 steps, and (with splash
+    # screens) start_game now and then to get past the title screens
+    actions = set()
+    step = 0
+    while True:
+        if step % 37 == 0:
+            actions = set(a for a in ("turn_left", "turn_right", "move_forward", "shoot")
+                          if rng.random() < 0.5)
+            if splashScreen and rng.random() < 0.3:
+                actions.add("start_game")
+        yield actions
+        step += 1
+
+def finalState(game):
+    world = game.currentWorld
+    if isinstance(world, GameWorld):
+        return world.snapshot()
+    return type(world).__name__
+
+def checkSession(path, steps, seed, splashScreen):
+    game = Game(None, splashScreen=splashScreen, seed=seed)
+    recorder = recording.Recorder(path, seed, (WORLD_WIDTH, WORLD_HEIGHT), TICK,
+                                  splashScreen=splashScreen)
+    actions = scriptedActions(random.Random(seed), splashScreen)
+    for _ in xrange(steps):
+        asteroids.stepGame(game, next(actions), TICK, recorder)
+    recorder.close()
+
+    replayed, replayedSteps = asteroids.replay(path)
+    failures = []
+    if replayedSteps != steps:
+        failures.append("replayed %d steps of %d" % (replayedSteps, steps))
+    if finalState(replayed) != finalState(game):
+        failures.append("the replayed game ended in a different state")
+    return failures, os.path.getsize(path)
+
+def checkLongRuns(path):
+    # runs longer than MAX_RUN are split across run records
+    masks = [recording.ACTION_BITS["shoot"]] * (3 * recording.MAX_RUN + 5) + [0] * 7
+    recorder = recording.Recorder(path, 1, (320, 240), 0.01, easyMode=True)
+    for mask in masks:
+        recorder.record(recording.maskActions(mask))
+    recorder.close()
+
+    failures = []
+    recorded = recording.Recording(path)
+    if [recording.actionMask(a) for a in recorded] != masks:
+        failures.append("long runs were not read back as recorded")
+    if (recorded.seed, recorded.size, recorded.dt, recorded.splashScreen, recorded.easyMode) \
+           != (1, (320, 240), 0.01, False, True):
+        failures.append("the header was not read back as written")
+    return failures
+
+def checkBadFile(path):
+    with open(path, "wb") as f:
+        f.write("not a recording")
+    try:
+        recording.Recording(path)
+    except ValueError:
+        return []
+    return ["a file that isn't a recording was accepted"]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check that recorded sessions replay exactly.")
+    parser.add_argument('--steps', type=int, default=5000,
+                        help='simulation steps per recorded session.')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='seed for the games and the scripted actions.')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "session.rec")
+        failures = []
+        for splashScreen in (False, True):
+            sessionFailures, size = checkSession(path, args.steps, args.seed, splashScreen)
+            print "%d steps (splash screens %s): %d-byte recording, %s" % (
+                args.steps, "on" if splashScreen else "off", size,
+                "; ".join(sessionFailures) or "replayed exactly")
+            failures += sessionFailures
+        failures += checkLongRuns(path)
+        failures += checkBadFile(path)
+    finally:
+        shutil.rmtree(directory)
+
+    for failure in failures:
+        print "FAILED:", failure
+    print "%d failures" % len(failures)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,212 @@
+# Check that GameWorld.sense gives exactly the percepts of the original
+# per-asteroid if/elif code (kept below as referenceSense) along each of
+# its paths: senseFew (used for up to SpatialGrid.SMALL asteroids), the
+# vectorised seeAsteroids path with and without the SpatialGrid, and
+# BatchEnv.sense. Seeded games are played with and without extra
+# asteroids, in the default world and in one big enough for the grid to
+# prune; asteroids are also placed right on the direction and distance
+# boundaries for every ship heading.
+#
+#   python checks/sense_check.py [--frames N] [--seed S]
+#
+# Exits with status 1 if any percepts differ.
+
+import math
+import os
+import random
+import sys
+
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, os.pardir))
+sys.path.insert(0, os.path.join(here, os.pardir, "benchmarks"))
+
+from asteroids import Asteroid, GameWorld, Game, Spaceship, WORLD_WIDTH, WORLD_HEIGHT, myround
+from batchenv import BatchEnv
+from sim_bench import addAsteroids
+from spatialgrid import SpatialGrid
+
+
+SIZES = [(WORLD_WIDTH, WORLD_HEIGHT), (2000, 1500)]
+# asteroids added to each game (on top of its own 5)
+EXTRAS = [0, 8, 40, 300]
+
+
+def referenceSense(world):
+    # the original GameWorld.sense, reading the asteroids from the store
+    # (as Python floats, like the original actors' coordinates)
+    percepts = set()
+    ship_direction = world.spaceship.direction
+    speed = myround(world.spaceship.getSpeed(), base=0.1)
+
+    n = len(world.asteroids)
+    for ax, ay in zip(world.asteroids.x[:n].tolist(), world.asteroids.y[:n].tolist()):
+        dx = ax - world.spaceship.x
+        dy = ay - world.spaceship.y
+
+        dist = math.sqrt((dx)**2+(dy)**2)
+
+        asteroid_direction = np.arctan2(dy, dx) % (math.pi * 2)
+        relative_direction = (asteroid_direction - ship_direction) % (math.pi * 2)
+        if relative_direction == math.pi * 2:
+            # (-tiny) % 2pi rounds to 2pi, which fell through every case
+            # below (reusing the last asteroid's direction); it is
+            # straight ahead
+            relative_direction = 0.0
+
+        # can the spaceship see the asteroid?
+        if dist > 300 or \
+           (relative_direction > GameWorld.SIDE_THRESHOLD and relative_direction < math.pi * 2 - GameWorld.SIDE_THRESHOLD):
+            # behind / not seen
+            pass
+        else:
+            # then it is seen
+            # translate these pi values into something more human-readable
+            if ( relative_direction <= GameWorld.DEAD_CENTRE_THRESHOLD and relative_direction >= 0) or \
+                (relative_direction >= math.pi * 2 - GameWorld.DEAD_CENTRE_THRESHOLD and relative_direction < math.pi * 2):
+                # dead centre
+                percept_direction = "dead_centre"
+            elif ( relative_direction <= GameWorld.CENTRE_THRESHOLD and relative_direction >= 0) or \
+                (relative_direction >= math.pi * 2 - GameWorld.CENTRE_THRESHOLD and relative_direction < math.pi * 2):
+                # centre
+                percept_direction = "centre"
+            elif relative_direction > GameWorld.CENTRE_THRESHOLD and relative_direction <= GameWorld.SIDE_THRESHOLD:
+                # right
+                percept_direction = "right"
+            elif relative_direction < math.pi * 2 - GameWorld.CENTRE_THRESHOLD and relative_direction >= math.pi * 2 - GameWorld.SIDE_THRESHOLD:
+                # left
+                percept_direction = "left"
+
+            percepts.add( ("see", ("asteroid", percept_direction, int(dist))) )
+            # add percept
+
+    percepts.add( ("facing_direction",(ship_direction,)) )
+    percepts.add( ("speed", (speed,)) )
+
+    return percepts
+
+
+def senseWith(world, small):
+    # world.sense() with SpatialGrid.SMALL set to small, which picks its path
+    saved = SpatialGrid.SMALL
+    SpatialGrid.SMALL = small
+    try:
+        return world.sense()
+    finally:
+        SpatialGrid.SMALL = saved
+
+def compare(world, description):
+    # returns the failures, and whether the vectorised path used the grid
+    expected = referenceSense(world)
+    failures = []
+    for path, small in (("sense", SpatialGrid.SMALL),
+                        ("senseFew", sys.maxint),
+                        ("the vectorised path", -1)):
+        if senseWith(world, small) != expected:
+            failures.append("%s differs in %s" % (path, description))
+    prunes = world.asteroidGrid.prunes(GameWorld.VISIBILITY_DISTANCE, len(world.asteroids))
+    return failures, prunes
+
+def randomActions(rng):
+    return set(a for a in ("turn_left", "move_forward", "shoot") if rng.random() < 0.5)
+
+
+def checkGames(size, extra, frames, seed):
+    failures = []
+    game = Game(None, splashScreen=False, size=size, seed=seed)
+    rng = random.Random(seed)
+    counts = []
+    pruned = 0
+    world = None
+    for frame in xrange(frames):
+        if game.currentWorld is not world:
+            # a new game: half the extra asteroids within sight of the ship
+            # (but not on top of it), the rest anywhere
+            world = game.currentWorld
+            addAsteroids(world, extra // 2, 60, 400)
+            addAsteroids(world, extra - extra // 2, 60, max(size))
+        world.handleActions(randomActions(rng))
+        world.step()
+        world = game.currentWorld
+        frameFailures, prunes = compare(world, "frame %d of a %dx%d game with %d asteroids"
+                                        % (frame, size[0], size[1], len(world.asteroids)))
+        failures += frameFailures
+        counts.append(len(world.asteroids))
+        pruned += prunes
+    return failures, min(counts), max(counts), pruned
+
+def checkBatch(size, extra, frames, seed, numEnvs=16):
+    failures = []
+    env = BatchEnv(numEnvs, size=size, seed=seed)
+    for world in env.worlds:
+        addAsteroids(world, extra, 60, 400)
+    rng = random.Random(seed)
+    for frame in xrange(frames):
+        env.step([randomActions(rng) for _ in xrange(numEnvs)])
+        for i, (percepts, world) in enumerate(zip(env.sense(), env.worlds)):
+            if percepts != referenceSense(world):
+                failures.append("BatchEnv.sense differs for environment %d in frame %d of %dx%d games"
+                                % (i, frame, size[0], size[1]))
+    return failures
+
+def checkBoundaries(size):
+    # asteroids just inside, on and just outside each direction bin and the
+    # visibility distance, for every heading of the ship
+    failures = []
+    game = Game(None, splashScreen=False, size=size, seed=0)
+    world = game.currentWorld
+    ship = world.spaceship
+    angles = [0.0, GameWorld.DEAD_CENTRE_THRESHOLD, GameWorld.CENTRE_THRESHOLD,
+              GameWorld.SIDE_THRESHOLD, math.pi]
+    for heading in xrange(Spaceship.HEADINGS):
+        ship.heading = heading
+        for distance in (50.0, 300.0):
+            for few in (False, True):
+                world.asteroids.clear()
+                for angle in angles:
+                    for side in (-1, 1):
+                        for nudge in (-1e-9, 0.0, 1e-9):
+                            a = ship.direction + side * angle * (1 + nudge)
+                            r = distance * (1 + nudge)
+                            Asteroid(world, (ship.x + r * math.cos(a), ship.y + r * math.sin(a)), 1)
+                        if few and len(world.asteroids) >= SpatialGrid.SMALL:
+                            break
+                    if few and len(world.asteroids) >= SpatialGrid.SMALL:
+                        break
+                failures += compare(world, "heading %d with asteroids on the boundaries at %g"
+                                    % (heading, distance))[0]
+    return failures
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check GameWorld.sense against the original code.")
+    parser.add_argument('--frames', type=int, default=300,
+                        help='frames to play in each game.')
+    parser.add_argument('--seed', type=int, default=3,
+                        help='seed for the games and the actions.')
+    args = parser.parse_args()
+
+    failures = []
+    for size in SIZES:
+        for extra in EXTRAS:
+            gameFailures, fewest, most, pruned = checkGames(size, extra, args.frames, args.seed)
+            batchFailures = checkBatch(size, extra, args.frames // 10, args.seed)
+            print "%dx%d, %d extra asteroids: %d frames with %d to %d asteroids (grid prunes in %d), " \
+                  "%d batched frames: %s" % (size[0], size[1], extra, args.frames, fewest, most, pruned,
+                                            args.frames // 10, "%d differences" %
+                                            len(gameFailures + batchFailures) if gameFailures or batchFailures
+                                            else "identical")
+            failures += gameFailures + batchFailures
+        boundaryFailures = checkBoundaries(size)
+        print "%dx%d, asteroids on the boundaries for %d headings: %s" % (
+            size[0], size[1], Spaceship.HEADINGS,
+            "%d differences" % len(boundaryFailures) if boundaryFailures else "identical")
+        failures += boundaryFailures
+
+    for failure in failures[:20]:
+        print "FAILED:", failure
+    print "%d failures" % len(failures)
+    sys.exit(1 if failures else 0)
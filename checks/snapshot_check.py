@@ -0,0 +1,93 @@
+# Check that GameWorld.snapshot()/restore() capture the whole state of a
+# game: a world is played on from a snapshot, restored and played on again
+# with the same actions, and both rollouts have to end in the same state.
+# The same goes for a snapshot restored into a world of a different game.
+# Also checks that mismatched snapshots are refused.
+#
+#   python checks/snapshot_check.py [--steps N] [--rollout N] [--seed S]
+#
+# Exits with status 1 if anything doesn't match.
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from asteroids import Game, GameWorld
+
+
+def play(game, steps, seed):
+    rng = random.Random(seed)
+    for _ in xrange(steps):
+        world = game.currentWorld
+        world.handleActions(set(a for a in ("turn_left", "move_forward", "shoot")
+                                if rng.random() < 0.5))
+        world.step()
+
+def state(game):
+    # the world's snapshot, plus the next random number to show that the
+    # game's generator is in step as well
+    return game.currentWorld.snapshot(), game.random.random()
+
+def checkRollouts(steps, rollout, seed):
+    failures = []
+    game = Game(None, splashScreen=False, seed=seed)
+    play(game, steps, seed)
+    world = game.currentWorld
+    blob = world.snapshot()
+
+    play(game, rollout, seed + 1)
+    first = state(game)
+
+    world.restore(blob)
+    play(game, rollout, seed + 1)
+    if state(game) != first:
+        failures.append("a rollout after restore() ended differently")
+
+    # a world of a brand new game, with a different seed
+    other = Game(None, splashScreen=False, seed=seed + 100)
+    other.currentWorld.restore(blob)
+    play(other, rollout, seed + 1)
+    if state(other) != first:
+        failures.append("a rollout in another game after restore() ended differently")
+
+    return failures, len(blob), len(world.asteroids), len(world.bullets)
+
+def checkRefused(seed):
+    failures = []
+    blob = Game(None, splashScreen=False, seed=seed).currentWorld.snapshot()
+    for description, world, data in [
+            ("a snapshot with the wrong magic",
+             Game(None, splashScreen=False).currentWorld, "XXXX" + blob[4:]),
+            ("a snapshot of a differently sized world",
+             Game(None, splashScreen=False, size=(320, 240)).currentWorld, blob)]:
+        try:
+            world.restore(data)
+            failures.append("%s was restored" % description)
+        except ValueError:
+            pass
+    return failures
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check GameWorld snapshots and restores.")
+    parser.add_argument('--steps', type=int, default=300,
+                        help='steps to play before taking the snapshot.')
+    parser.add_argument('--rollout', type=int, default=500,
+                        help='steps to play on from the snapshot.')
+    parser.add_argument('--seed', type=int, default=11,
+                        help='seed for the game and the actions.')
+    args = parser.parse_args()
+
+    failures, size, numAsteroids, numBullets = checkRollouts(args.steps, args.rollout, args.seed)
+    print "%d-byte snapshot (%d asteroids, %d bullets), %d-step rollouts: %s" % (
+        size, numAsteroids, numBullets, args.rollout, "; ".join(failures) or "identical")
+    failures += checkRefused(args.seed)
+
+    for failure in failures:
+        print "FAILED:", failure
+    print "%d failures" % len(failures)
+    sys.exit(1 if failures else 0)
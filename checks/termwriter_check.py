@@ -0,0 +1,220 @@
+# Check that pedroclient.TermWriter writes terms that PedroParser reads
+# back as the same terms: atoms that need quoting and escaping (quotes,
+# newlines, control and symbol characters), compound terms, nested lists
+# and sets, bools, longs and numpy scalars, and terms that were parsed.
+# None of them may contain a raw newline, which would end a Pedro message
+# early. Also times writing the percept messages of a seeded game.
+#
+#   python checks/termwriter_check.py [--frames N] [--seed S]
+#
+# Exits with status 1 if anything doesn't read back.
+
+import os
+import random
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import pedroclient
+from pedroclient import PObject
+from asteroids import Game
+
+
+ATOMS = [
+    "a", "hello_World", "e1", "Caps", "_under", "two words", "it's", "'", "''", "back\\slash",
+    "line\nbreak", "\n", "tab\there", "cr\rlf", "bell\x07", "nul\x00", "del\x7f", "esc\x1b[0m",
+    "quote'\n'mix", "\\n", "+", "-", "->", ":-", "=..", "[]", "{}", "[", "]", "|", ",", ";", "!",
+    "a.b", "\xc3\xa9t\xc3\xa9", "",
+]
+
+VALUES = [
+    # compound terms
+    ("see", ("asteroid", "left", 12)), ("f", [1, 2.5]), ("f", ()), ("f", ("a\nb", "it's")),
+    ("g", (("h", ("x",)), [1, [2, [3]]])), ("-", (1,)), ("-", (1.5,)), ("-", ("a",)),
+    ("-", (-1,)), ("[]", ("x",)), ("{}", ("x",)), ("line\nbreak", ("x",)), ("+", (1, 2)),
+    # lists and sets
+    [], [[]], [1, [2, [3, []]]], (1, 2, 3), ((1, 2), (3,)), set(), frozenset(),
+    set([1, 2, 3]), frozenset(["a", "b c"]), [set([1]), frozenset(), (set(["x\ny"]),)],
+    set([("see", ("asteroid", "dead_centre", 40)), ("speed", (0.25,)), ("facing_direction", ("left",))]),
+    ("delta", (set([("speed", (-2.5,))]), set())),
+    # numbers and bools
+    True, False, 0, -3, 2 ** 70, -2 ** 70, long(5), 1.5, -0.25, 1e-9, 123456.789, 0.30000000000000004,
+    np.int8(-4), np.int32(-4), np.int64(2 ** 40), np.uint8(200), np.uint64(2 ** 63),
+    np.float32(0.5), np.float64(-2.75), np.bool_(True), np.bool_(False),
+    [np.int64(1), np.float64(2.0), np.bool_(True), True, 2 ** 64],
+]
+
+# parsed terms are written back as they are
+TERMS = [
+    "f(X, 'a b', [1, 2|T], \"str\", -3, 1.5, g(h))", "\"a\\nb\"", "\"it's \\\"q\\\"\"",
+    "\"bell\\x07\"", "'a\\nb'", "'it\\'s'", "'[]'(x)", "'-'(1)", "[a, \"s\\tt\"|T]",
+    "p2pmsg(a@b, c:d@'h', f(\"x\\ny\"))",
+]
+
+
+def atomName(text):
+    # the name of an atom as written (and as PedroParser keeps it)
+    if text.startswith("'"):
+        return text[1:-1].decode('string-escape')
+    return text
+
+def elements(term):
+    # the elements of a proper list (the atom [] is the empty list)
+    kind = term.get_type()
+    if kind == PObject.atomtype and term.val == '[]':
+        return []
+    if kind == PObject.listtype and term.toList() is not None:
+        return term.toList()
+    return None
+
+def matches(value, term):
+    # True if the parsed term is value
+    kind = term.get_type()
+    if isinstance(value, (bool, np.bool_)):
+        return kind == PObject.atomtype and term.val == ('true' if value else 'false')
+    if isinstance(value, (int, long, np.integer)):
+        return kind == PObject.inttype and term.val == int(value)
+    if isinstance(value, (float, np.floating)):
+        return kind == PObject.floattype and term.val == float('%.6f' % value)
+    if isinstance(value, str):
+        return kind == PObject.atomtype and atomName(term.val) == value
+    if isinstance(value, tuple) and len(value) == 2 and isinstance(value[0], str) \
+           and isinstance(value[1], (tuple, list)):
+        functor, args = value
+        if not args:
+            return matches(functor, term)
+        return kind == PObject.structtype and atomName(term.functor.val) == functor \
+               and len(term.args) == len(args) and all(map(matches, args, term.args))
+    terms = elements(term)
+    if terms is None or len(terms) != len(value):
+        return False
+    if isinstance(value, (set, frozenset)):
+        # in any order
+        terms = list(terms)
+        for v in value:
+            for i, t in enumerate(terms):
+                if matches(v, t):
+                    del terms[i]
+                    break
+            else:
+                return False
+        return True
+    return all(map(matches, value, terms))
+
+def dump(term):
+    # a term as nested tuples, with atoms by name
+    kind = term.get_type()
+    if kind == PObject.listtype:
+        return ('list', tuple(dump(e) for e in term.elements), dump(term.rest))
+    if kind == PObject.structtype:
+        return ('struct', dump(term.functor), tuple(dump(a) for a in term.args))
+    if kind == PObject.atomtype:
+        return (kind, atomName(term.val))
+    return (kind, term.val)
+
+
+def written(value):
+    writer = pedroclient.TermWriter()
+    writer.write(value)
+    return str(writer)
+
+def readBack(text):
+    try:
+        return pedroclient.PedroParser().parse(text)
+    except pedroclient.ParseError:
+        return None
+
+def checkValue(value):
+    failures = []
+    try:
+        text = written(value)
+    except TypeError as e:
+        return ["%r was not written: %s" % (value, e)]
+    if '\n' in text:
+        failures.append("%r was written with a raw newline: %r" % (value, text))
+    term = readBack(text)
+    if term is None or not matches(value, term):
+        failures.append("%r was written as %r, which reads back as %s"
+                        % (value, text, "a parse error" if term is None else repr(str(term))))
+    if isinstance(value, str):
+        # p2p sends a str as Prolog text, not as an atom
+        return failures
+    # and inside a p2p message, which has to be one line
+    message = pedroclient._p2p_message("asteroids", "host", "agent@localhost", value)
+    if message.count('\n') != 1 or not message.endswith('\n'):
+        failures.append("the p2p message with %r is not one line: %r" % (value, message))
+    else:
+        term = readBack(message[:-1])
+        if term is None or not matches(value, term.args[2]):
+            failures.append("the p2p message with %r doesn't read back: %r" % (value, message))
+    return failures
+
+def checkTerm(text):
+    original = pedroclient.PedroParser().parse(text)
+    again = written(original)
+    if '\n' in again:
+        return ["%r was written back with a raw newline: %r" % (text, again)]
+    term = readBack(again)
+    if term is None or dump(term) != dump(original):
+        return ["%r was written back as %r, which reads back differently" % (text, again)]
+    return []
+
+
+def perceptFrames(frames, seed):
+    # the percepts sensed in each frame of a seeded game
+    game = Game(None, splashScreen=False, seed=seed)
+    rng = random.Random(seed)
+    percepts = []
+    for _ in xrange(frames):
+        world = game.currentWorld
+        world.handleActions(set(a for a in ("turn_left", "move_forward", "shoot")
+                                if rng.random() < 0.5))
+        world.step()
+        percepts.append(game.currentWorld.sense())
+    return percepts
+
+def timeWriting(percepts, number):
+    # microseconds per frame to write each frame's percepts as a p2p
+    # message, the way PedroClient.p2p does
+    writer = pedroclient.TermWriter()
+    def writeAll():
+        for p in percepts:
+            writer.reset()
+            pedroclient._write_p2p_message(writer, "asteroids", "host", "agent@localhost", p)
+    seconds = min(timeit.repeat(writeAll, number=number, repeat=3)) / number
+    return seconds / len(percepts) * 1e6
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check that TermWriter's terms read back.")
+    parser.add_argument('--frames', type=int, default=1000,
+                        help='frames of percepts to time writing.')
+    parser.add_argument('--seed', type=int, default=5,
+                        help='seed for the game and the actions.')
+    args = parser.parse_args()
+
+    values = ATOMS + [("f", (atom,)) for atom in ATOMS] + [(atom, (1,)) for atom in ATOMS if atom] \
+             + [[atom] for atom in ATOMS] + VALUES
+    failures = []
+    for value in values:
+        failures += checkValue(value)
+    for text in TERMS:
+        failures += checkTerm(text)
+    print "%d values and %d parsed terms written" % (len(values), len(TERMS))
+
+    percepts = perceptFrames(args.frames, args.seed)
+    average = float(sum(len(p) for p in percepts)) / len(percepts)
+    print "%d frames of percepts (%.1f percepts on average): %.1f us per frame" % (
+        args.frames, average, timeWriting(percepts, 5))
+    largest = max(percepts, key=len)
+    print "the largest frame (%d percepts): %.1f us" % (len(largest), timeWriting([largest], 2000))
+
+    for failure in failures:
+        print "FAILED:", failure
+    print "%d failures" % len(failures)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,215 @@
+# Run headless episodes on every core, with observations passed back to the
+# parent through shared memory rather than pickled through a pipe.
+#
+# Each worker owns a ring of fixed-layout frame slots in one shared array.
+# It writes a frame (ship state, asteroids and the "see" percepts) into the
+# next free slot and tells the parent which slots are ready with a small
+# message on a queue; the parent reads the frames in place and hands the
+# slots back. Episode i is always seeded with baseSeed + i and played with
+# its own policy RNG, so results don't depend on how many workers there are
+# or which worker ran which episode.
+
+import Queue
+import multiprocessing
+import random
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+from asteroids import Game, TICK
+
+
+DIRECTION_CODES = {"dead_centre": 0, "centre": 1, "left": 2, "right": 3}
+ACTIONS = ("turn_left", "turn_right", "move_forward", "move_backward", "shoot")
+
+# how long the parent waits for a message before checking on the workers
+WORKER_POLL_TIME = 1.0
+
+
+def policySeed(seed):
+    # the seed of the policy RNG playing the game seeded with seed, so that
+    # the two don't draw the same sequence of numbers
+    return seed + 0x9e3779b9
+
+
+def idlePolicy(percepts, rng):
+    return set()
+
+
+def randomPolicy(percepts, rng):
+    return set(a for a in ACTIONS if rng.random() < 0.5)
+
+
+class FrameLayout(object):
+    # Where everything lives in one frame slot (an array of float64).
+    HEADER = ("episode", "step", "done", "points",
+              "shipX", "shipY", "shipVX", "shipVY", "shipDirection", "speed",
+              "numAsteroids", "numSeen")
+
+    def __init__(self, maxAsteroids=64, maxSeen=32):
+        self.maxAsteroids = maxAsteroids
+        self.maxSeen = maxSeen
+
+        self.field = dict((name, i) for i, name in enumerate(FrameLayout.HEADER))
+        self.asteroidsAt = len(FrameLayout.HEADER)
+        self.seenAt = self.asteroidsAt + 3 * maxAsteroids
+        self.size = self.seenAt + 2 * maxSeen
+
+    def write(self, frame, world, episode, step, done, percepts):
+        ship = world.spaceship
+        frame[:self.asteroidsAt] = (episode, step, done, world.points,
+                                    ship.x, ship.y, ship.vx, ship.vy, ship.direction,
+                                    ship.getSpeed(), 0, 0)
+
+        # asteroids beyond maxAsteroids are dropped; numAsteroids still
+        # records how many there really were
+        n = len(world.asteroids)
+        k = min(n, self.maxAsteroids)
+        asteroids = frame[self.asteroidsAt:self.seenAt].reshape(self.maxAsteroids, 3)
+        asteroids[:k,0] = world.asteroids.x[:k]
+        asteroids[:k,1] = world.asteroids.y[:k]
+        asteroids[:k,2] = world.asteroids.size[:k]
+        frame[self.field["numAsteroids"]] = n
+
+        seen = frame[self.seenAt:self.size].reshape(self.maxSeen, 2)
+        k = 0
+        for functor, args in percepts:
+            if functor == "see" and k < self.maxSeen:
+                seen[k] = (DIRECTION_CODES[args[1]], args[2])
+                k += 1
+        frame[self.field["numSeen"]] = k
+
+    def get(self, frame, name):
+        return frame[self.field[name]]
+
+    def asteroids(self, frame):
+        n = min(int(self.get(frame, "numAsteroids")), self.maxAsteroids)
+        return frame[self.asteroidsAt:self.seenAt].reshape(self.maxAsteroids, 3)[:n]
+
+    def seen(self, frame):
+        n = int(self.get(frame, "numSeen"))
+        return frame[self.seenAt:self.size].reshape(self.maxSeen, 2)[:n]
+
+
+def _runWorker(workerId, episodes, config, shared, freeSlots, messages):
+    layout = config["layout"]
+    slots = config["slotsPerWorker"]
+    chunk = config["chunk"]
+
+    ring = np.frombuffer(shared, dtype=np.float64).reshape(-1, slots, layout.size)[workerId]
+    head = 0
+    pending = 0
+
+    for episode in episodes:
+        seed = config["baseSeed"] + episode
+        game = Game(None, easyMode=config["easyMode"], splashScreen=False, seed=seed)
+        policyRng = random.Random(policySeed(seed))
+        world = game.currentWorld
+        percepts = world.sense()
+
+        step = 0
+        done = False
+        while not done and step < config["maxSteps"]:
+            world.handleActions(config["policy"](percepts, policyRng))
+            world.step(config["dt"])
+            step += 1
+
+            # the game swaps in a fresh world as soon as this one is over
+            done = game.currentWorld is not world
+            percepts = world.sense()
+
+            freeSlots.acquire()
+            layout.write(ring[head % slots], world, episode, step, done, percepts)
+            head += 1
+            pending += 1
+            if pending == chunk:
+                messages.put(("frames", workerId, head - pending, pending))
+                pending = 0
+
+        if pending:
+            messages.put(("frames", workerId, head - pending, pending))
+            pending = 0
+        messages.put(("episode", workerId, episode, seed, step, world.points))
+
+    messages.put(("finished", workerId))
+
+
+class EpisodeFarm(object):
+    def __init__(self, numWorkers=None, slotsPerWorker=256, maxAsteroids=64, maxSeen=32):
+        self.numWorkers = numWorkers or multiprocessing.cpu_count()
+        self.slotsPerWorker = slotsPerWorker
+        self.layout = FrameLayout(maxAsteroids, maxSeen)
+
+        self.shared = RawArray("d", self.numWorkers * slotsPerWorker * self.layout.size)
+        self.rings = np.frombuffer(self.shared, dtype=np.float64).reshape(
+            self.numWorkers, slotsPerWorker, self.layout.size)
+
+    def run(self, numEpisodes, maxSteps=1000, baseSeed=0, policy=randomPolicy,
+            onFrame=None, easyMode=False, dt=TICK):
+        # Play numEpisodes episodes across the workers. onFrame(frame) is
+        # called in the parent for every frame, with frame a view into shared
+        # memory that is only valid during the call (read it with
+        # self.layout). Returns (episode, seed, steps, points) per episode,
+        # in episode order.
+        config = {
+            "layout": self.layout,
+            "slotsPerWorker": self.slotsPerWorker,
+            "chunk": max(1, self.slotsPerWorker // 4),
+            "baseSeed": baseSeed,
+            "maxSteps": maxSteps,
+            "policy": policy,
+            "easyMode": easyMode,
+            "dt": dt,
+        }
+
+        messages = multiprocessing.Queue()
+        freeSlots = [multiprocessing.Semaphore(self.slotsPerWorker) for _ in range(self.numWorkers)]
+        workers = []
+        for w in range(self.numWorkers):
+            episodes = range(w, numEpisodes, self.numWorkers)
+            p = multiprocessing.Process(target=_runWorker,
+                                        args=(w, episodes, config, self.shared, freeSlots[w], messages))
+            p.daemon = True
+            p.start()
+            workers.append(p)
+
+        results = []
+        finished = set()
+        # workers seen to have exited without finishing; their last
+        # messages get one more WORKER_POLL_TIME to arrive
+        suspects = set()
+        while len(finished) < len(workers):
+            try:
+                message = messages.get(timeout=WORKER_POLL_TIME)
+            except Queue.Empty:
+                dead = set(w for w, p in enumerate(workers)
+                           if w not in finished and p.exitcode is not None)
+                crashed = dead & suspects
+                if crashed:
+                    for p in workers:
+                        if p.is_alive():
+                            p.terminate()
+                    w = min(crashed)
+                    raise RuntimeError("farm worker %d exited with code %s before finishing its episodes"
+                                       % (w, workers[w].exitcode))
+                suspects = dead
+                continue
+            kind, workerId = message[0], message[1]
+            if kind == "frames":
+                _, _, start, count = message
+                if onFrame is not None:
+                    ring = self.rings[workerId]
+                    for i in range(start, start + count):
+                        onFrame(ring[i % self.slotsPerWorker])
+                for _ in range(count):
+                    freeSlots[workerId].release()
+            elif kind == "episode":
+                results.append(message[2:])
+            elif kind == "finished":
+                finished.add(workerId)
+
+        for p in workers:
+            p.join()
+
+        results.sort()
+        return results
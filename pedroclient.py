@@ -28,11 +28,15 @@ PObject and subclasses -- Prolog terms
 PedroParser class and support -- parsing strings representing Prolog terms
 into Prolog Objects
 
+TermWriter class -- writing Prolog terms (and plain Python values) as text
+
 PedroClient class -- The Pedro client interface class
 
+AsyncPedroClient class -- A single-threaded, event-driven Pedro client
+
 """
 
-import re, socket, threading, Queue, select
+import re, socket, threading, Queue, select, collections, asyncore, time
 
 
 # Classes for Prolog terms
@@ -41,8 +45,13 @@ class PObject(object):
 
     """ The Prolog object base class.
     This is intended as an abstract class.
+
+    Terms are small and plentiful, so the classes use __slots__ and keep
+    their type tag as a class attribute.
     
     """
+
+    __slots__ = ()
     
     # type tags
     inttype = 0
@@ -53,10 +62,7 @@ class PObject(object):
     listtype = 5
     structtype = 6
 
-    # to keep pychecker happy
-    def __init__(self):
-        self.type = PObject.inttype
-        self.val = 0
+    type = inttype
     
     def __str__(self):
         return str(self.val)
@@ -64,41 +70,54 @@ class PObject(object):
     def get_type(self):
         return self.type
 
+    def copy(self):
+        """ Return a copy of this term that shares no mutable parts. """
+        return self.__class__(self.val)
+
 
 class PInteger(PObject):
             
     """ Prolog integer subclass of PObject. """
+
+    __slots__ = ('val',)
+    type = PObject.inttype
     
     def __init__(self, v):
         """ v is the integer value of this object."""
         self.val = v
-        self.type = PObject.inttype
 
 
 class PFloat(PObject):
                 
     """ Prolog float subclass of PObject. """
+
+    __slots__ = ('val',)
+    type = PObject.floattype
     
     def __init__(self, v):
         """ v is the float value of this object."""
         self.val = v
-        self.type = PObject.floattype
 
 
 class PVar(PObject):
                 
     """ Prolog variable subclass of PObject. """
+
+    __slots__ = ('val',)
+    type = PObject.vartype
         
     def __init__(self,name):
         """ name is the name of this object."""
         self.val = name
-        self.type = PObject.vartype
 
 
 class PString(PObject):                
 
     """ Prolog string subclass of PObject. """      
 
+    __slots__ = ('val',)
+    type = PObject.stringtype
+
     def __init__(self,chars,unescape = False):
         """ chars is the string value of this object."""
         if unescape:
@@ -106,7 +125,6 @@ class PString(PObject):
             self.val = stripped_chars.decode('string-escape') # un-escape the string
         else:
             self.val = chars
-        self.type = PObject.stringtype
 
     def __str__(self):
         """ return the string representation - escape + escape " + add quotes. """
@@ -116,70 +134,126 @@ class PString(PObject):
 
 class PAtom(PObject):
 
-    """ Prolog atom subclass of PObject. """        
+    """ Prolog atom subclass of PObject.
+
+    atomize returns one shared PAtom for each unquoted name (as the parser
+    uses), so atoms are immutable: val can't be changed once it is set.
+    Quoted names can be any text at all, so they aren't interned, and
+    neither is anything once MAX_INTERNED names have been.
+
+    """        
+
+    __slots__ = ('val',)
+    type = PObject.atomtype
+
+    # name -> the interned atom
+    _atoms = {}
+    MAX_INTERNED = 4096
 
     @classmethod
     def atomize(cls, stringOrAtom):
         if stringOrAtom.__class__ == PAtom:
             return stringOrAtom
-        else:
-            return PAtom(stringOrAtom)
+        atom = PAtom._atoms.get(stringOrAtom)
+        if atom is None:
+            atom = PAtom(stringOrAtom)
+            if not stringOrAtom.startswith("'") \
+                   and len(PAtom._atoms) < PAtom.MAX_INTERNED:
+                PAtom._atoms[stringOrAtom] = atom
+        return atom
  
     def __init__(self,name):
         """ name is the name of this object."""
         self.val = name
-        self.type = PObject.atomtype
+
+    def __setattr__(self, name, value):
+        if name == 'val' and hasattr(self, 'val'):
+            raise AttributeError("atoms are immutable")
+        PObject.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError("atoms are immutable")
+
+    def copy(self):
+        """ Atoms are immutable, so a copy is the atom itself. """
+        return self
 
 
 class PList(PObject):
 
     """ Prolog list subclass of PObject.
 
-    Stored as a cons pair.
+    Stored as a Python list of the elements together with the term after
+    the last element (normally the atom []), rather than as cons pairs.
+    head and tail are still available; tail makes a new PList.
 
     """
+
+    __slots__ = ('elements', 'rest')
+    type = PObject.listtype
     
     def __init__(self,h,t):
         """  h and t are the head an tail of the list."""
-        self.head = h
-        self.tail = t
-        self.type = PObject.listtype
+        if t.type == PObject.listtype:
+            self.elements = [h] + t.elements
+            self.rest = t.rest
+        else:
+            self.elements = [h]
+            self.rest = t
+
+    @classmethod
+    def from_list(cls, elements, tail = None):
+        """ Return the Prolog list of the terms in the (non-empty) Python
+        list elements, followed by tail (default []). elements is used as
+        is, not copied.
+
+        """
+        lst = cls.__new__(cls)
+        if tail is None:
+            tail = PAtom.atomize('[]')
+        if tail.type == PObject.listtype:
+            elements = elements + tail.elements
+            tail = tail.rest
+        lst.elements = elements
+        lst.rest = tail
+        return lst
+
+    @property
+    def head(self):
+        return self.elements[0]
+
+    @property
+    def tail(self):
+        if len(self.elements) == 1:
+            return self.rest
+        return PList.from_list(self.elements[1:], self.rest)
 
     def __str__(self):
         """ Display the Prolog list in standard Prolog form. """
         
-        head = self.head
-        tail = self.tail
-        s = '[' + str(head)
-        while tail.type == PObject.listtype:
-            head = tail.head
-            tail = tail.tail
-            s += ', ' + str(head)
-        if tail.val == '[]':
-            s += ']'
+        s = '[' + ', '.join([str(e) for e in self.elements])
+        if self.rest.val == '[]':
+            return s + ']'
         else:
-            s += '|'+str(tail)+']'
-        return s
+            return s + '|' + str(self.rest) + ']'
             
     def toList(self):
         """ Return a Python list from the Prolog list
 
         return None if list does not end with a []
+
+        This is the list's own element list, not a copy.
         """
 
-        lst = []
-        head = self.head
-        lst.append(head)
-        tail = self.tail
-        while tail.type == PObject.listtype:
-            head = tail.head
-            lst.append(head)
-            tail = tail.tail
-        if tail.val == '[]':
-            return lst
+        if self.rest.val == '[]':
+            return self.elements
         else:
             return None
 
+    def copy(self):
+        """ Return a copy of this list that shares no mutable parts. """
+        return PList.from_list([e.copy() for e in self.elements], self.rest.copy())
+
 class PStruct(PObject):
 
     """ Prolog structure subclass of PObject.
@@ -188,23 +262,26 @@ class PStruct(PObject):
     the arguments of the strudture.
     
     """
+
+    __slots__ = ('functor', 'args')
+    type = PObject.structtype
+
     def __init__(self,f,lst):
         """ f is the functor term and lst is the argument list. """
         self.functor = PAtom.atomize(f)
         self.args = lst
-        self.type = PObject.structtype
 
     def arity(self):
         """ Return the arity of the structure. """
         return len(self.args)
+
+    def copy(self):
+        """ Return a copy of this structure that shares no mutable parts. """
+        return PStruct(self.functor.copy(), [a.copy() for a in self.args])
     
     def __str__(self):
         """ Display the Prolog structure in standard Prolog form. """
-        s = str(self.functor) + '(' + str(self.args[0])
-        for i in self.args[1:]:
-            s = s + ', ' + str(i)
-        s = s + ')'
-        return s
+        return str(self.functor) + '(' + ', '.join([str(a) for a in self.args]) + ')'
 
 
 class ParseError(Exception):
@@ -218,64 +295,72 @@ class ParseError(Exception):
         return repr(self.pos)
 
 
-# A regular expression to distinguish between strings representing
-# integers and floats
-_floatRE = re.compile("[.eE]")
-
-def _number_convert(x):
-    """ Return the tagged token of the input string representing a number."""
-    if (_floatRE.search(x)):
-        return ('float', float(x))
-    else:
-        return ('int', int(x))
-
-# A table of regular expressions that recognise tokens of various types
-# and functions for conveting such strings into tagged tokens
-_retable = (
-    (  # for number tokens
-    re.compile(r"""
-    \d+
-    (?:\.\d+)?(?:[eE][+-]?\d+)?
-    """, re.VERBOSE),
-    _number_convert
-    ),
-    (  # for the tokens ( ) [ ] ,
-    re.compile(r"""
-    \( | \) | \[ | \] | , | \|
-    """, re.VERBOSE),
-    lambda x: ('sym', x)
-    ),
-    (  # for variable tokens
-    re.compile(r"""
-    [A-Z][A-Za-z0-9_]*
-    """, re.VERBOSE),
-    lambda x: ('var', x)
-    ),
-    (  # for string tokens
-    re.compile(r"""
-    \"[^\"\\]*(?:\\.[^\"\\]*)*\"
-    """, re.VERBOSE),
-    lambda x: ('string', x)
-    ),
-    (  # for atom tokens
-    re.compile(r"""
-    [a-z][A-Za-z0-9_]* |
-    '[^'\\]*(?:\\.[^'\\]*)*' |
-    [-/+*<=>#@$\\^&~`:.?!;]+ |
-    {}
-    """, re.VERBOSE),
-    lambda x: ('atom', x)
-    ),
-    (  # catchall
-    re.compile(r"""
-    .*
-    """, re.VERBOSE),
-    lambda x: ('eos', 'eos')
+# A single regular expression recognising every kind of token. The
+# alternatives are tried in order at each position, so e.g. numbers win
+# over atoms; the name of the group that matched is the token's type.
+_tokenRE = re.compile(r"""
+    \s*
+    (?:
+    (?P<float> \d+\.\d+(?:[eE][+-]?\d+)? | \d+[eE][+-]?\d+ ) |
+    (?P<int> \d+ ) |
+    (?P<sym> \( | \) | \[ | \] | , | \| ) |
+    (?P<var> [A-Z][A-Za-z0-9_]* ) |
+    (?P<string> \"[^\"\\]*(?:\\.[^\"\\]*)*\" ) |
+    (?P<atom>
+      [a-z][A-Za-z0-9_]* |
+      '[^'\\]*(?:\\.[^'\\]*)*' |
+      [-/+*<=>#@$\\^&~`:.?!;]+ |
+      \{\}
+    )
     )
-)
+    """, re.VERBOSE)
 
-# A regular expression used for consuming spaces in the parser
-_spacesRE = re.compile('\s*')
+def _tokenize(string):
+    """ Return the list of tagged tokens (type, value, end position) in
+    string, always ending with an 'eos' token.
+
+    Anything that is not a token ends the token list, as does the end of
+    the string.
+
+    """
+    tokens = []
+    match = _tokenRE.match
+    pos = 0
+    while True:
+        m = match(string, pos)
+        if m is None:
+            break
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == 'int':
+            value = int(value)
+        elif kind == 'float':
+            value = float(value)
+        pos = m.end()
+        tokens.append((kind, value, pos))
+    tokens.append(('eos', 'eos', len(string)))
+    return tokens
+
+# The infix operators: name -> (precedence, type). For xfx and xfy the left
+# argument must bind tighter than the operator; for yfx it may be another
+# use of an operator of the same precedence (left associative). Likewise
+# xfy operators are right associative.
+_infix_ops = {
+    ':': (50, 'xfx'),
+    '@': (100, 'xfx'),
+    '**': (200, 'xfx'),
+    '*': (400, 'yfx'), '/': (400, 'yfx'), '//': (400, 'yfx'),
+    'mod': (400, 'yfx'), '>>': (400, 'yfx'), '<<': (400, 'yfx'),
+    '+': (500, 'yfx'), '-': (500, 'yfx'), '\\/': (500, 'yfx'), '/\\': (500, 'yfx'),
+    '=': (700, 'xfx'), 'is': (700, 'xfx'), '<': (700, 'xfx'), '>': (700, 'xfx'),
+    '=<': (700, 'xfx'), '>=': (700, 'xfx'),
+    ',': (1000, 'xfy'),
+    '->': (1050, 'xfy'),
+    ';': (1100, 'xfy'),
+}
+
+# the precedence of prefix - (whose argument has precedence at most 100)
+_prefix_minus_prec = 200
 
 class PedroParser:
     
@@ -284,273 +369,640 @@ class PedroParser:
     The method parse(string) returns a Prolog term (using Prolog term
     classes). An exception is thrown if the string does not parse.
 
+    The string is split into tokens in one pass and then parsed by
+    operator precedence using the _infix_ops table.
+
     """
     def __init__(self):
         """ Set the string to be pased and the position in the string."""
 
         self.string = ''
+        self.tokens = []
         self.pos = 0
 
-    def __next_token(self):
-        """ Return the next tagged token from string at position pos. """
+    def __error(self):
+        """ Raise a ParseError at the current token. """
+        raise ParseError, self.tokens[self.pos][2]
 
-        self.pos = _spacesRE.match(self.string, self.pos).end()
-        for (regexp, fun) in _retable:
-            m = regexp.match(self.string, self.pos)
-            if m:
-                self.curr_token = fun(m.group())
-                self.pos = m.end()
+    def __term(self, max_prec):
+        """ Return the term starting at the current token whose principal
+        operator has precedence at most max_prec.
+
+        """
+        tokens = self.tokens
+        kind, value, _ = tokens[self.pos]
+        if value == '-' and kind == 'atom' and max_prec >= _prefix_minus_prec:
+            self.pos += 1
+            t1 = self.__term(100)
+            # if we have - as a prefix operator followed by a number
+            # then return the negated number
+            if (t1.get_type() == PObject.inttype) or \
+               (t1.get_type() == PObject.floattype):
+                t1.val *= -1
+            else:
+                t1 = PStruct(PAtom.atomize('-'), [t1])
+            left_prec = _prefix_minus_prec
+        else:
+            t1 = self.__basic()
+            left_prec = 0
+
+        while True:
+            kind, value, _ = tokens[self.pos]
+            if kind != 'atom' and kind != 'sym':
+                break
+            op = _infix_ops.get(value)
+            if op is None:
+                break
+            prec, optype = op
+            if prec > max_prec:
                 break
+            if optype == 'yfx':
+                if left_prec > prec:
+                    break
+                right_prec = prec - 1
+            else:
+                if left_prec >= prec:
+                    break
+                right_prec = prec if optype == 'xfy' else prec - 1
+            self.pos += 1
+            t2 = self.__term(right_prec)
+            t1 = PStruct(PAtom.atomize(value), [t1, t2])
+            left_prec = prec
+        return t1
 
-    # return the list of terms representing structure argument
     def __parseargs(self):
         """ Return the list of prolog terms of an argument list."""
 
-        t1 = [self.__prec700()]
-        while (self.curr_token[1] == ','):
-            self.__next_token()
-            t2 = self.__prec700()
-            t1.append(t2)
-        return t1
+        tokens = self.tokens
+        args = [self.__term(700)]
+        while (tokens[self.pos][1] == ','):
+            self.pos += 1
+            args.append(self.__term(700))
+        return args
 
-    # return the list of terms representing list elements
     def __parselistargs(self):
         """ Return the list of prolog terms from a list."""
-        t1 = self.__prec700()
-        if (self.curr_token[1] == ','):
-            self.__next_token()
-            t2 = self.__parselistargs()
-            return PList(t1, t2)
-        elif self.curr_token[1] == '|':
-            self.__next_token()
-            t2 = self.__prec700()
-            return PList(t1, t2)
-        else:
-            return PList(t1, PAtom('[]'))
 
-    # parsing a basic term
+        tokens = self.tokens
+        elements = [self.__term(700)]
+        while True:
+            value = tokens[self.pos][1]
+            if (value == ','):
+                self.pos += 1
+                elements.append(self.__term(700))
+            elif value == '|':
+                self.pos += 1
+                tail = self.__term(700)
+                break
+            else:
+                tail = None
+                break
+        return PList.from_list(elements, tail)
+
     def __basic(self):
         """ Return a simple parsed term."""
+
+        tokens = self.tokens
+        kind, value, _ = tokens[self.pos]
         # nothing left - error
-        if (self.curr_token[0] == 'eos'):
-            raise ParseError, self.pos
+        if (kind == 'eos'):
+            self.__error()
+        self.pos += 1
         # a string token 
-        if (self.curr_token[0] == 'string'):
-            t1 = PString(self.curr_token[1], True)
-            self.__next_token()
-            return t1
+        if (kind == 'string'):
+            return PString(value, True)
         # a var token
-        if (self.curr_token[0] == 'var'):
-            t1 = PVar(self.curr_token[1])
-            self.__next_token()
-            return t1
+        if (kind == 'var'):
+            return PVar(value)
         # an int token
-        if (self.curr_token[0] == 'int'):
-            t1 = PInteger(self.curr_token[1])
-            self.__next_token()
-            return t1
+        if (kind == 'int'):
+            return PInteger(value)
         # a float token
-        if (self.curr_token[0] == 'float'):
-            t1 = PFloat(self.curr_token[1])
-            self.__next_token()
-            return t1
+        if (kind == 'float'):
+            return PFloat(value)
         # the start of a bracketed term
         # error if not terminated by a closing bracket
-        if (self.curr_token[1] == '('):
-            self.__next_token()
-            t1 = self.__prec1100()
-            if (self.curr_token[1] == ')'):
-                self.__next_token()
+        if (value == '('):
+            t1 = self.__term(1100)
+            if (tokens[self.pos][1] == ')'):
+                self.pos += 1
                 return t1
-            raise ParseError,self.pos
+            self.__error()
         # the start of a Prolog list
         # error if not terminated by ]
-        if (self.curr_token[1] == '['):
-            self.__next_token()
-            if (self.curr_token[1] == ']'):
-                self.__next_token()
-                return PAtom('[]')
+        if (value == '['):
+            if (tokens[self.pos][1] == ']'):
+                self.pos += 1
+                return PAtom.atomize('[]')
             t1 = self.__parselistargs()
-            if (self.curr_token[1] == ']'):
-                self.__next_token()
+            if (tokens[self.pos][1] == ']'):
+                self.pos += 1
                 return t1
-            raise ParseError, self.pos
+            self.__error()
         # at this point the current token is an atom token
-        t1 = PAtom(self.curr_token[1])
-        self.__next_token()
-        if (self.curr_token[1] != '('):
+        t1 = PAtom.atomize(value)
+        if (tokens[self.pos][1] != '('):
             return t1
         # we have a structured term - e.g. f(a1, a2)
-        self.__next_token()
+        self.pos += 1
         t2 = self.__parseargs()
-        if (self.curr_token[1] == ')'):
-            self.__next_token()
-            t2 = PStruct(t1, t2)
-            return t2
-        raise ParseError, self.pos
-
-    def __prec50(self):
-        """ Parse a precedence 50 term. """
+        if (tokens[self.pos][1] == ')'):
+            self.pos += 1
+            return PStruct(t1, t2)
+        self.__error()
+
+    def parse(self, str):
+        """ Parse str into a Prolog term.
+
+        An error is thrown if the string does not parse.
+
+        """
         
-        t1 = self.__basic()
-        if (self.curr_token[1] == ':'):
-            op = PAtom(':')
-            self.__next_token()
-            t2 = self.__basic()
-            t1 = PStruct(op, [t1, t2])
-        return t1
+        self.string = str
+        self.tokens = _tokenize(str)
+        self.pos = 0
+        t = self.__term(1100)
+        if (self.tokens[self.pos][0] != 'eos'):
+            self.__error()
+        return t
 
-    def __prec100(self):
-        """ Parse a precedence 100 term. """
-            
-        t1 = self.__prec50()
-        if (self.curr_token[1] == '@'):
-            op = PAtom('@')
-            self.__next_token()
-            t2 = self.__prec50()
-            t1 = PStruct(op, [t1, t2])
-        return t1
 
-    def __prec200(self):
-        """ Parse a precedence 200 term. """
-            
-        if (self.curr_token[0] == 'eos'):
-            raise ParseError, self.pos
-        if (self.curr_token[1] == '-'):
-            self.__next_token()
-            t2 = self.__prec100()
-            # if we have - as a prefix operator followed by a number
-            # then return the negated number
-            if (t2.get_type() == PObject.inttype) or \
-               (t2.get_type() == PObject.floattype):
-                t2.val *= -1
-                return t2
-            op = PAtom('-')
-            return PStruct(op, [t2])
-        t1 = self.__prec100()
-        if (self.curr_token[1] == '**'):
-            op = PAtom('**')
-            self.__next_token()
-            t2 = self.__prec100()
-            t1 = PStruct(op, [t1, t2])
-        return t1
 
-    def __prec400(self):
-        """ Parse a precedence 400 term with left associative ops."""
+class ParseCache(object):
+    """ A bounded LRU cache from message strings to parsed Prolog terms.
 
-        t1 = self.__prec200()   
-        while (self.curr_token[1] in
-            ('*', '/', '//', 'mod', '>>', '<<')):
-            op = PAtom(self.curr_token[1])
-            self.__next_token()
-            t2 = self.__prec200()
-            t1 = PStruct(op, [t1, t2])
-        return t1
+    Agents send the same few messages over and over, so most messages need
+    not be parsed again. The cached terms are never handed out: parse()
+    returns a copy, so callers can't corrupt an entry. hits and misses
+    count lookups.
 
-    def __prec500(self):
-        """ Parse a precedence 500 term with left associative ops."""
+    """
 
-        t1 = self.__prec400()   
-        while (self.curr_token[1] in ('+','-', '\\/', '/\\')):
-            op = PAtom(self.curr_token[1])
-            self.__next_token()
-            t2 = self.__prec400()
-            t1 = PStruct(op, [t1, t2])
-        return t1
+    def __init__(self, parser, size=128):
+        self.parser = parser
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def parse(self, string):
+        """ Return (a copy of) the term string parses to. """
+
+        term = self.entries.pop(string, None)
+        if term is None:
+            self.misses += 1
+            term = self.parser.parse(string)
+            if len(self.entries) >= self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+        # (re)inserting makes this the most recently used entry
+        self.entries[string] = term
+        return term.copy()
 
-    def __prec700(self):
-        """ Parse a precedence 700 term."""
+    def clear(self):
+        self.entries.clear()
 
-        t1 = self.__prec500()
-        if (self.curr_token[1] in ('=', 'is', '<', '>', '=<', '>=')):
-            op = PAtom(self.curr_token[1])
-            self.__next_token()
-            t2 = self.__prec500()
-            t1 = PStruct(op, [t1, t2])
-        return t1
 
-    def __prec1000(self):
-        """ Parse a precedence 1000 term."""
+# atoms that can be written without quotes (the unquoted atom tokens, but
+# see _AtomTable for -)
+_plain_atom = re.compile(r"^(?:[a-z][A-Za-z0-9_]*|[-/+*<=>#@$\\^&~`:.?!;]+|\[\]|\{\})$")
 
-        t1 = self.__prec700()
-        if (self.curr_token[1] == ','):
-            op = PAtom(self.curr_token[1])
-            self.__next_token()
-            t2 = self.__prec1000()
-            t1 = PStruct(op, [t1, t2])
-        return t1
+# characters that have to be escaped in a quoted atom (a raw newline in
+# particular would end a Pedro message early); other control characters
+# are written as \xHH, as the 'string-escape' codec PString uses does
+_atom_special = re.compile(r"[\\'\x00-\x1f\x7f]")
+_atom_escapes = {'\\': '\\\\', "'": "\\'", '\n': '\\n', '\t': '\\t', '\r': '\\r'}
 
-    def __prec1050(self):
-        """ Parse a precedence 1050 term."""
+def _escape_atom_char(match):
+    c = match.group()
+    return _atom_escapes.get(c) or '\\x%02x' % ord(c)
 
-        t1 = self.__prec1000()
-        if (self.curr_token[1] == '->'):
-            op = PAtom(self.curr_token[1])
-            self.__next_token()
-            t2 = self.__prec1050()
-            t1 = PStruct(op, [t1, t2])
-        return t1
+class _AtomTable(dict):
+    """ Maps atom names to their written form, quoting them as needed. """
 
-    def __prec1100(self):
-        """ Parse a precedence 1100 term."""
+    def __missing__(self, name):
+        # a bare - is read as the prefix operator, e.g. in f(-) or [-]
+        if _plain_atom.match(name) and name != '-':
+            text = name
+        else:
+            text = "'" + _atom_special.sub(_escape_atom_char, name) + "'"
+        self[name] = text
+        return text
 
-        t1 = self.__prec1050()
-        if (self.curr_token[1] == ';'):
-            op = PAtom(self.curr_token[1])
-            self.__next_token()
-            t2 = self.__prec1100()
-            t1 = PStruct(op, [t1, t2])
-        return t1
+class _FunctorTable(dict):
+    """ Maps functor names to the written start of a compound term. """
 
-    def parse(self, str):
-        """ Parse str into a Prolog term.
+    def __init__(self, atoms):
+        dict.__init__(self)
+        self.atoms = atoms
 
-        An error is thrown if the string does not parse.
+    def __missing__(self, name):
+        if name == '[]':
+            # [](x) doesn't parse
+            text = "'[]'("
+        else:
+            text = self.atoms[name] + '('
+        self[name] = text
+        return text
 
-        """
-        
-        self.string = str
-        self.pos = 0
-        self.__next_token()
-        # try:
-        t = self.__prec1100()
-        if (self.curr_token[0] != 'eos'):
-            raise ParseError, self.pos
-        return t
-#except ParseError, e:
-#    print "Parse error at position", e.pos
-#    return None
+class TermWriter(object):
+    """ Writes Prolog terms into a reusable bytearray.
+
+    write() takes PObjects or plain Python values: int and float are
+    numbers, str is an atom (quoted when it needs to be), a tuple
+    (functor, args) with args a tuple or list is a compound term, and a
+    list, tuple, set or frozenset of anything else is a Prolog list.
+    Floats are written with a fixed number of decimal places.
+
+    The text is written into buffer, which can be sent to a socket as it
+    is; reset() empties it for the next message and take() hands it over
+    and starts a new one.
+
+    """
 
+    def __init__(self, float_precision = 6):
+        self.buffer = bytearray()
+        self.float_format = '%.' + str(float_precision) + 'f'
+        self.atoms = _AtomTable()
+        self.functors = _FunctorTable(self.atoms)
+        # type -> function returning the text of a value of that type; the
+        # lookups are all done by exact type, so the common cases need no
+        # isinstance tests and (for numbers and atoms) no Python calls
+        self.texts = {
+            int: str,
+            long: str,
+            float: self.float_format.__mod__,
+            str: self.atoms.__getitem__,
+            tuple: self.tuple_text,
+            list: self.list_text,
+            set: self.list_text,
+            frozenset: self.list_text,
+            }
+        for cls in (PInteger, PFloat, PVar, PString, PAtom, PList, PStruct):
+            self.texts[cls] = self.pobject_text
+
+    def __str__(self):
+        return str(self.buffer)
+
+    def reset(self):
+        del self.buffer[:]
+
+    def take(self):
+        """ Return the buffer and start a new, empty one. """
+
+        buffer = self.buffer
+        self.buffer = bytearray()
+        return buffer
+
+    def write_raw(self, text):
+        """ Write text as it is - e.g. a term already in Prolog syntax. """
+        self.buffer.extend(text)
+
+    def write(self, value):
+        """ Write value as a Prolog term. """
+        self.buffer.extend(self.text(value))
+
+    def text(self, value):
+        """ Return the text of value as a Prolog term. """
+
+        convert = self.texts.get(value.__class__)
+        if convert is not None:
+            return convert(value)
+        # e.g. numpy scalars and subclasses of the types above
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        elif isinstance(value, (int, long)):
+            return str(int(value))
+        elif isinstance(value, float):
+            return self.float_format % value
+        elif isinstance(value, str):
+            return self.atoms[value]
+        elif isinstance(value, PObject):
+            return self.pobject_text(value)
+        elif isinstance(value, tuple):
+            return self.tuple_text(value)
+        elif isinstance(value, (list, set, frozenset)):
+            return self.list_text(value)
+        elif hasattr(value, 'item') and not hasattr(value, '__len__'):
+            # other numpy scalars, e.g. numpy.bool_, int32 and float32
+            return self.text(value.item())
+        raise TypeError("can't write %r as a Prolog term" % (value,))
+
+    def args_text(self, values):
+        """ Return the texts of values separated by commas. """
+
+        texts = self.texts
+        try:
+            return ','.join([texts[v.__class__](v) for v in values])
+        except KeyError:
+            return ','.join([self.text(v) for v in values])
+
+    def tuple_text(self, value):
+        if len(value) == 2 and value[0].__class__ is str \
+               and isinstance(value[1], (tuple, list)):
+            functor, args = value
+            if not args:
+                return self.atoms[functor]
+            return self.functors[functor] + self.args_text(args) + ')'
+        return '[' + self.args_text(value) + ']'
+
+    def list_text(self, elements, rest = None):
+        texts = self.texts
+        functors = self.functors
+        parts = []
+        try:
+            for element in elements:
+                if element.__class__ is tuple and len(element) == 2 \
+                       and element[1].__class__ is tuple and element[1]:
+                    # inline tuple_text for lists of compound terms such as
+                    # percepts, which are by far the most common thing written
+                    functor, args = element
+                    parts.append(functors[functor]
+                                 + ','.join([texts[a.__class__](a) for a in args])
+                                 + ')')
+                else:
+                    parts.append(texts[element.__class__](element))
+        except (KeyError, TypeError):
+            parts = [self.text(element) for element in elements]
+        if rest is not None and rest.val != '[]':
+            return '[' + ','.join(parts) + '|' + self.text(rest) + ']'
+        return '[' + ','.join(parts) + ']'
+
+    def pobject_text(self, term):
+        # parsed atoms keep any quotes in val, so they are written as they are
+        kind = term.type
+        if kind == PObject.listtype:
+            return self.list_text(term.elements, term.rest)
+        elif kind == PObject.structtype:
+            return term.functor.val + '(' + self.args_text(term.args) + ')'
+        elif kind == PObject.floattype:
+            return self.float_format % term.val
+        elif kind == PObject.stringtype:
+            # str(term) doesn't escape val, so a newline in it would be sent raw
+            return '"' + term.val.encode('string-escape').replace('"', '\\"') + '"'
+        return str(term)
+
+
+class LineReader(object):
+    """ Splits the data arriving on a socket into lines.
+
+    Data is received with recv_into into one preallocated bytearray of
+    size bytes, and every complete line in it is split off in a single
+    pass; only the unfinished last line is kept (in partial) for the next
+    read. So however many lines arrive at once, each byte is copied a
+    fixed number of times.
+
+    """
+
+    def __init__(self, sock, size = 4096):
+        self.sock = sock
+        self.size = size
+        self.buffer = bytearray(size)
+        self.partial = bytearray()
+
+    def read(self):
+        """ Receive once from the socket and return the list of lines
+        (without their newlines) completed by what arrived - often none.
+        Return None if the connection was closed.
+
+        """
 
+        n = self.sock.recv_into(self.buffer, self.size)
+        if n == 0:
+            return None
+        return self.split(n)
+
+    def split(self, n):
+        """ Return the lines completed by the first n bytes of buffer. """
+
+        buffer = self.buffer
+        end = buffer.rfind('\n', 0, n)
+        if end == -1:
+            self.partial.extend(buffer[:n])
+            return []
+        if self.partial:
+            self.partial.extend(buffer[:end])
+            lines = str(self.partial).split('\n')
+            del self.partial[:]
+        else:
+            lines = str(buffer[:end]).split('\n')
+        if end + 1 < n:
+            self.partial.extend(buffer[end+1:n])
+        return lines
 
-running = True
 
 class Reader( threading.Thread ):
-    """The message reader thread."""
+    """The message reader thread.
+
+    Puts the lines completed by each read on the queue as one batch: a
+    (time read, list of lines) pair. Clearing running (as PedroClient.disconnect does) stops the thread.
+
+    """
 
-    def __init__( self, q, sock ):
+    def __init__( self, q, sock, size = 4096 ):
         self.q = q
-        self.sock = sock
+        self.lines = LineReader(sock, size)
+        self.running = True
         threading.Thread.__init__(self)
 
     def run( self ):
-        buff = ""
-        while (running):
-            chars = self.sock.recv(1024)
-            if (chars == ''):
+        while (self.running):
+            try:
+                lines = self.lines.read()
+            except socket.error:
                 break
-            buff = buff + chars
-            pos = buff.find('\n')
-            while (pos != -1):
-                message = buff[:pos]
-                self.q.put(message)
+            if lines is None:
+                break
+            if lines:
+                self.q.put((time.time(), lines))
+
+class Writer( threading.Thread ):
+    """The message writer thread of a pipelined client.
+
+    Sends the client's unsent requests in order until the client is
+    disconnected. A failed send means the connection is lost.
+
+    """
+
+    def __init__( self, client ):
+        self.client = client
+        threading.Thread.__init__(self)
+
+    def run( self ):
+        client = self.client
+        while True:
+            with client.ack_lock:
+                while client.connected and not client.unsent:
+                    client.ack_lock.wait()
+                if not client.connected:
+                    break
+                request = client.unsent.popleft()
+            try:
+                client.datasock.sendall(request.message)
+            except socket.error:
+                client._connection_lost()
+                break
+
+class AckReader( threading.Thread ):
+    """The ack reader thread of a pipelined client.
+
+    The server acks requests in the order they were sent, so each ack is
+    handed to the client to match against its oldest pending request.
+    An error or end of file on the ack socket means the connection is lost.
+
+    """
+
+    def __init__( self, client ):
+        self.client = client
+        threading.Thread.__init__(self)
 
-                buff = buff[(pos+1):]
-                pos = buff.find('\n')
+    def run( self ):
+        lines = LineReader(self.client.acksock, 1024)
+        while (self.client.connected):
+            try:
+                acks = lines.read()
+            except socket.error:
+                acks = None
+            if acks is None:
+                self.client._connection_lost()
+                break
+            for ack in acks:
+                self.client._ack_received(int(ack))
+
+class _PendingRequest(object):
+    """ A pipelined request waiting for its ack, with the Queue its caller
+    waits on (None if nobody waits).
+
+    """
+
+    __slots__ = ('message', 'waiter')
+
+    def __init__(self, message, waiter):
+        self.message = message
+        self.waiter = waiter
 
 # for testing if a P2P address is a variable
 _p2p_var_addr = re.compile("^[_A-Z][^:]*$")
 
+def _read_line(sock, size):
+    """ Read from sock until a newline arrives and return what was read. """
+
+    pos = -1
+    buff = ''
+    while (pos == -1):
+        chars = sock.recv(size)
+        buff = buff + chars
+        pos = buff.find('\n')
+    return buff
+
+def _open_connection(machine, port):
+    """ Do the Pedro connection handshake.
+
+    Return (machine, acksock, datasock, id_string, my_machine_name),
+    or None if the server refused the connection.
+
+    """
+
+    # connect to info
+    infosock = socket.socket()
+    infosock.connect((machine, port))
+    # get info from server on info socket
+    parts = _read_line(infosock, 64).split()
+    machine = parts[0]
+    ack_port = int(parts[1])
+    data_port = int(parts[2])
+    infosock.close()
+    # connect to ack
+    acksock = socket.socket()
+    acksock.connect((machine, ack_port))
+    # get my ID
+    id_string = _read_line(acksock, 32)
+    # connect to data
+    datasock = socket.socket()
+    datasock.connect((machine, data_port))
+    datasock.send(id_string)
+    # get ok from server on data socket
+    if _read_line(datasock, 32) != 'ok\n':
+        try:
+            acksock.shutdown(socket.SHUT_RDWR)
+            acksock.close()
+            datasock.shutdown(socket.SHUT_RDWR)
+            datasock.close()
+        except:
+            pass
+        return None
+    ip = acksock.getsockname()[0]
+    try:
+        # if DNS lookup works then the following will succeed
+        my_machine_name = socket.gethostbyaddr(ip)[0]
+        socket.getaddrinfo(my_machine_name, 0)
+        # check that we get the same IP back OW use original IP
+        if ip != socket.gethostbyname(my_machine_name):
+            my_machine_name = ip
+    except:
+        # otherwise set to ip
+        my_machine_name = ip
+    return (machine, acksock, datasock, id_string, my_machine_name)
+
+def _addr2str(addr):
+    """ Return the string form of a p2p address given as a string or term. """
+
+    if isinstance(addr, str):
+        return addr
+    assert isinstance(addr, PStruct)
+    assert addr.functor.val == '@' and addr.arity() == 2
+    host = addr.args[1]
+    name = addr.args[0]
+    if isinstance(name, PStruct):
+        assert name.functor.val == ':' and name.arity() == 2
+        return str(name.args[0]) + ':'+ str(name.args[1]) + '@' + str(host)
+    else:
+        return str(name) + '@' + str(host)
+
+def _p2p_header(name, machine_name, toaddr):
+    """ Return the start of a p2pmsg line from name to toaddr - everything
+    up to the message term. """
+
+    straddr = _addr2str(toaddr)
+    if '@' in straddr:
+        straddr = straddr.replace('localhost', "'"+machine_name+"'")
+        return 'p2pmsg(' + straddr + ', '\
+               + name + "@'" + machine_name + "',"
+    elif _p2p_var_addr.match(toaddr):
+        return 'p2pmsg(' + straddr \
+               + ", " \
+               + name + "@'" + machine_name + "',"
+    else:
+        return 'p2pmsg(' + straddr \
+               + "@'" + machine_name + "', " \
+               + name + "@'" + machine_name + "',"
+
+def _write_p2p_message(writer, name, machine_name, toaddr, term):
+    """ Write the p2pmsg line sending term from name to toaddr.
+
+    term is either a string in Prolog syntax, sent as it is, or anything
+    else writer.write accepts.
+
+    """
+
+    writer.write_raw(_p2p_header(name, machine_name, toaddr))
+    if isinstance(term, str):
+        writer.write_raw(term)
+    else:
+        writer.write(term)
+    writer.write_raw(')\n')
+
+def _p2p_message(name, machine_name, toaddr, term):
+    """ Return the p2pmsg line sending term from name to toaddr. """
+
+    writer = TermWriter()
+    _write_p2p_message(writer, name, machine_name, toaddr, term)
+    return str(writer.buffer)
+
 class PedroClient:
     """ A Pedro Client.
 
@@ -578,7 +1030,14 @@ class PedroClient:
 
     deregister() - deregister with server.
 
-    p2p(addr, term) - send term as a p2p message to addr.
+    p2p(addr, term) - send term as a p2p message to addr - term is a
+    string in Prolog syntax or anything TermWriter.write takes. A pipelined
+    client queues the message and returns 1 straight away; a failed ack
+    for it is counted in failed_acks and passed to ack_callback. Once
+    max_pending requests wait for acks, each new p2p message drops the
+    oldest one not yet sent (or itself, if all have been sent), and
+    messages that are dropped or lost with the connection are counted in
+    dropped_messages.
 
     get_notification() - get the first notification from the message queue
     of notifications sent from the server as a string.
@@ -586,22 +1045,48 @@ class PedroClient:
     get_term() - the same as get_notification except the message is parsed
     into a representation of a Prolog term - see PedroParser.
 
+    get_terms() - get every notification received so far as Prolog terms,
+    without waiting.
+
     notification_ready() - test if a notification is ready to read.
 
     parse_string(string) - parse string into a Prolog term.
     """
     
-    def __init__(self, machine='localhost', port=4550, async = True):
+    def __init__(self, machine='localhost', port=4550, async = True,
+                 pipelined = False, ack_callback = None, parse_cache_size = 0,
+                 read_size = 4096, max_pending = 1024):
         """ Initialize the client.
 
         machine -- then address of the machine the Pedro server is running.
         port -- the port the Pedro server is using for connections.
         async -- determines if messages are read asynchronously
+        pipelined -- if True, messages are sent from a writer thread and
+        acks are collected by a reader thread, so p2p never waits for the
+        server.
+        ack_callback -- called with the message text of every pipelined
+        p2p message the server refused.
+        parse_cache_size -- if not 0, get_term keeps the terms of up to this
+        many recently received messages in a ParseCache (parse_cache) and
+        reuses them when the same message arrives again.
+        read_size -- the size of the buffer incoming messages are read into.
+        max_pending -- how many requests a pipelined client lets wait for
+        acks before it drops unsent p2p messages.
         
         """
         self.machine = machine
         self.port = port
         self.connected = False
+        self.pipelined = pipelined
+        self.ack_callback = ack_callback
+        self.failed_acks = 0
+        self.dropped_messages = 0
+        self.max_pending = max_pending
+        # outgoing p2p messages are written straight into this buffer
+        self.writer = TermWriter()
+        self.write_lock = threading.Lock()
+        self.parse_cache_size = parse_cache_size
+        self.read_size = read_size
   	self.async = async
         self.connect()
         self.name = ''
@@ -617,92 +1102,86 @@ class PedroClient:
         if (self.connected):
             return 0
         else:
-            running = True
-            # connect to info
-            infosock = socket.socket()
-            infosock.connect((self.machine, self.port))
-            # get info from server on info socket
-            pos = -1
-            buff = ''
-            while (pos == -1):
-                chars = infosock.recv(64)
-                buff = buff + chars
-                pos = buff.find('\n')
-            parts = buff.split()
-            self.machine = parts[0]
-            ack_port = int(parts[1])
-            data_port = int(parts[2])
-            infosock.close()
-            # connect to ack
-            self.acksock = socket.socket()
-            self.acksock.connect((self.machine, ack_port))
-            # get my ID
-            pos = -1
-            buff = ''
-            while (pos == -1):
-                chars = self.acksock.recv(32)
-                buff = buff + chars
-                pos = buff.find('\n')
-            self.id_string = buff
-            # connect to data
-            self.datasock = socket.socket()
-            self.datasock.connect((self.machine, data_port))
-            self.datasock.send(self.id_string)
-            # get ok from server on data socket
-            pos = -1
-            buff = ''
-            while (pos == -1):
-                chars = self.datasock.recv(32)
-                buff = buff + chars
-                pos = buff.find('\n')
-            if buff != 'ok\n':
-                try:
-                    self.acksock.shutdown(socket.SHUT_RDWR)
-                    self.acksock.close()
-                    self.datasock.shutdown(socket.SHUT_RDWR)
-                    self.datasock.close()
-                except:
-                    pass
+            connection = _open_connection(self.machine, self.port)
+            if connection is None:
                 return 0
-            ip = self.acksock.getsockname()[0]
-            try:
-                # if DNS lookup works then the following will succeed
-                self.my_machine_name = socket.gethostbyaddr(ip)[0]
-                socket.getaddrinfo(self.my_machine_name, 0)
-                # check that we get the same IP back OW use original IP
-                if ip != socket.gethostbyname(self.my_machine_name):
-                    self.my_machine_name = ip
-            except:
-                # otherwise set to ip
-                self.my_machine_name = ip
+            (self.machine, self.acksock, self.datasock,
+             self.id_string, self.my_machine_name) = connection
 
             self.q = Queue.Queue(0)
             self.parser = PedroParser()
+            if self.parse_cache_size:
+                self.parse_cache = ParseCache(self.parser, self.parse_cache_size)
+            else:
+                self.parse_cache = None
             self.connected = True
+            # (time read, line) for the lines of the batches taken off q
+            self.pending = collections.deque()
             if self.async:
-                thread = Reader(self.q, self.datasock)
-                thread.setDaemon(True)
-                thread.start()
+                self.reader = Reader(self.q, self.datasock, self.read_size)
+                self.reader.setDaemon(True)
+                self.reader.start()
             else:
-                self.buff = ''
+                self.lines = LineReader(self.datasock, self.read_size)
+            if self.pipelined:
+                # the _PendingRequests waiting for acks in send order, and
+                # the ones the writer thread hasn't taken yet
+                self.pending_acks = collections.deque()
+                self.unsent = collections.deque()
+                self.ack_lock = threading.Condition()
+                writer = Writer(self)
+                writer.setDaemon(True)
+                writer.start()
+                acks = AckReader(self)
+                acks.setDaemon(True)
+                acks.start()
             return 1
 
     def disconnect(self):
         """ Disconnect the client. """
         
         if (self.connected):
-            running = False
+            if self.pipelined:
+                self._connection_lost()
+                return 1
+            if self.async:
+                self.reader.running = False
             self.connected = False
-            try:
-                self.acksock.shutdown(socket.SHUT_RDWR)
-                self.acksock.close()
-                self.datasock.shutdown(socket.SHUT_RDWR)
-                self.datasock.close()
-            except:
-                pass
+            self._close_sockets()
             return 1
         else:
             return 0
+
+    def _close_sockets(self):
+        try:
+            self.acksock.shutdown(socket.SHUT_RDWR)
+            self.acksock.close()
+            self.datasock.shutdown(socket.SHUT_RDWR)
+            self.datasock.close()
+        except:
+            pass
+
+    def _connection_lost(self):
+        """ Disconnect a pipelined client. Requests still waiting for an
+        ack complete with 0 and p2p messages still waiting are dropped.
+
+        """
+
+        with self.ack_lock:
+            if not self.connected:
+                return
+            self.connected = False
+            for request in self.pending_acks:
+                if request.waiter is not None:
+                    request.waiter.put(0)
+                else:
+                    self.dropped_messages += 1
+            self.pending_acks.clear()
+            self.unsent.clear()
+            self.ack_lock.notify_all()
+        if self.async:
+            self.reader.running = False
+        self._close_sockets()
                     
     def get_ack(self):
         """ Get an acknowledgement from the server. """
@@ -715,13 +1194,80 @@ class PedroClient:
             pos = buff.find('\n')
         r = int(buff)   
         return r
+
+    def _ack_received(self, ack):
+        """ Match an ack read by the AckReader with its request. """
+
+        with self.ack_lock:
+            if not self.pending_acks:
+                # the connection was lost
+                return
+            request = self.pending_acks.popleft()
+        if request.waiter is not None:
+            request.waiter.put(ack)
+        elif ack == 0:
+            self.failed_acks += 1
+            if self.ack_callback is not None:
+                self.ack_callback(str(request.message))
+
+    def _queue_message(self, message, waiter):
+        """ Queue message for the writer thread of a pipelined client.
+        Return False if the client is disconnected.
+
+        """
+
+        request = _PendingRequest(message, waiter)
+        # the lock keeps the pending queue in the same order as the sends
+        with self.ack_lock:
+            if not self.connected:
+                return False
+            if (waiter is None and len(self.pending_acks) >= self.max_pending
+                    and not self._drop_unsent()):
+                # every waiting p2p message has been sent, so drop this one
+                self.dropped_messages += 1
+                return True
+            self.pending_acks.append(request)
+            self.unsent.append(request)
+            self.ack_lock.notify()
+        return True
+
+    def _drop_unsent(self):
+        """ Drop the oldest unsent p2p message, if there is one, and return
+        True if one was dropped (called with ack_lock held).
+
+        """
+
+        for request in self.unsent:
+            if request.waiter is None:
+                self.unsent.remove(request)
+                self.pending_acks.remove(request)
+                self.dropped_messages += 1
+                return True
+        return False
+
+    def _request(self, message):
+        """ Send message to the server and return the ack. """
+
+        if self.pipelined:
+            waiter = Queue.Queue(1)
+            if not self._queue_message(message, waiter):
+                return 0
+            return waiter.get()
+        self.datasock.sendall(message)
+        return self.get_ack()
+
+    def pending_ack_count(self):
+        """ Return the number of pipelined requests not yet acked. """
+
+        if self.pipelined:
+            return len(self.pending_acks)
+        return 0
     
     def notify(self, term):
         """ Send a notification to the server and return the ack. """
         
         if (self.connected):
-            self.datasock.send(str(term)+'\n')
-            return self.get_ack()
+            return self._request(str(term)+'\n')
         else:
             return 0
             
@@ -729,9 +1275,8 @@ class PedroClient:
         """ Send a subscription to the server and return the ack. """
         
         if (self.connected):
-            self.datasock.send('subscribe(' + str(term) + ', (' +
-                           str(goal) + '), ' + str(rock) + ')\n')
-            return self.get_ack()
+            return self._request('subscribe(' + str(term) + ', (' +
+                                 str(goal) + '), ' + str(rock) + ')\n')
         else:
             return 0
 
@@ -740,8 +1285,7 @@ class PedroClient:
         """ Send an unsubscription to the server and return the ack. """
         
         if (self.connected):
-            self.datasock.send('unsubscribe(' + str(id) + ')\n')
-            return self.get_ack()
+            return self._request('unsubscribe(' + str(id) + ')\n')
         else:
             return 0
 
@@ -750,8 +1294,7 @@ class PedroClient:
         """ Register the client's name with the server and return the ack. """
         
         if (self.connected):
-            self.datasock.send('register(' + name + ')\n')
-            ack = self.get_ack()
+            ack = self._request('register(' + name + ')\n')
             if (ack != 0):
                     self.name = name 
             return ack
@@ -762,8 +1305,7 @@ class PedroClient:
         """ Unregister the client's name with the server and return the ack. """
         
         if (self.connected):
-            self.datasock.send('deregister(' + self.name + ')\n')
-            ack = self.get_ack()
+            ack = self._request('deregister(' + self.name + ')\n')
             if (ack != 0):
                 self.name = ''
             return ack
@@ -771,53 +1313,46 @@ class PedroClient:
             return 0
 
     def addr2str(self, addr):
-        if isinstance(addr, str):
-            return addr
-        assert isinstance(addr, PStruct)
-        assert addr.functor.val == '@' and addr.arity() == 2
-        host = addr.args[1]
-        name = addr.args[0]
-        if isinstance(name, PStruct):
-            assert name.functor.val == ':' and name.arity() == 2
-            return str(name.args[0]) + ':'+ str(name.args[1]) + '@' + str(host)
-        else:
-            return str(name) + '@' + str(host)
+        return _addr2str(addr)
 
     def p2p(self, toaddr, term):
-        """ Send a p2p message to the server and return the ack. """
+        """ Send a p2p message to the server and return the ack.
+
+        A pipelined client doesn't wait for the ack: it returns 1 once the
+        message is queued, and 0 if it is disconnected.
+
+        """
         #print toaddr
-        straddr = self.addr2str(toaddr)
-        name = self.my_machine_name
-        if (self.name == ''):
+        if (self.name == '' or not self.connected):
             return 0
-        elif '@' in straddr:
-            straddr = straddr.replace('localhost', "'"+name+"'")
-            self.datasock.send('p2pmsg(' + straddr + ', '\
-                               + self.name + "@'" + name\
-                               +  "'," + str(term) + ')\n')
-            return self.get_ack()
-        elif _p2p_var_addr.match(toaddr):
-            self.datasock.send('p2pmsg(' + straddr \
-                                   + ", " \
-                                   + self.name + "@'" + name\
-                                   +  "'," + str(term) + ')\n')
-            return self.get_ack()
-        else:
-            self.datasock.send('p2pmsg(' + straddr \
-                                   + "@'" + name + "', " \
-                                   + self.name + "@'" + name\
-                                   +  "'," + str(term) + ')\n')
-            return self.get_ack()
+        with self.write_lock:
+            writer = self.writer
+            writer.reset()
+            _write_p2p_message(writer, self.name, self.my_machine_name, toaddr, term)
+            if self.pipelined:
+                # the queued message keeps the buffer; the writer starts a new one
+                return 1 if self._queue_message(writer.take(), None) else 0
+            return self._request(writer.buffer)
 
     def _pop_rock(self, str):
         """Gets the rock off of the message, returning (message_to_parse, rock)"""
         rock, message = str.split(" ", 1)
         return (message, int(rock))
 
+    def _next_message(self):
+        """ Return the next message line, waiting for one if need be. """
+
+        if not self.pending:
+            self._unpack(self.q.get())
+        return self.pending.popleft()[1]
+
+    def _unpack(self, (received, lines)):
+        self.pending.extend([(received, line) for line in lines])
+
     def get_notification(self):
         """ Return the next notification and rock received. """
-        if self.async or not self.q.empty():
-            buf = self.q.get()
+        if self.async or self.pending or not self.q.empty():
+            buf = self._next_message()
             return self._pop_rock(buf)
         else:
             return None
@@ -827,13 +1362,42 @@ class PedroClient:
 
         """
 
-        if self.async or not self.q.empty():
-            buf = self.q.get()
+        if self.async or self.pending or not self.q.empty():
+            buf = self._next_message()
             msg, rock = self._pop_rock(buf)
+            if self.parse_cache is not None:
+                return (self.parse_cache.parse(msg), rock)
             return (self.parser.parse(msg), rock)
         else:
             return None
 
+    def get_terms(self):
+        """ Return every notification received so far, without waiting.
+
+        The result is a list, oldest first, of (term, rock, age) triples,
+        age being how many seconds ago the message was read off the socket.
+        
+        """
+
+        if not self.async:
+            self.notification_ready()
+        while True:
+            try:
+                self._unpack(self.q.get_nowait())
+            except Queue.Empty:
+                break
+        now = time.time()
+        if self.parse_cache is not None:
+            parse = self.parse_cache.parse
+        else:
+            parse = self.parser.parse
+        terms = []
+        while self.pending:
+            received, line = self.pending.popleft()
+            msg, rock = self._pop_rock(line)
+            terms.append((parse(msg), rock, now - received))
+        return terms
+
     def parse_string(self, string):
         """Return string as a Prolog term"""
         return self.parser.parse(string)
@@ -845,16 +1409,270 @@ class PedroClient:
             # otherwise the read thread does the work
             sin,_,_ = select.select([self.datasock], [], [], 0)
             while sin:
-                chars = self.datasock.recv(1024)
-                if (chars == ''):
+                lines = self.lines.read()
+                if lines is None:
                     break
-                self.buff = self.buff + chars
-                pos = self.buff.find('\n')
-                while (pos != -1):
-                    s = self.buff[:pos]
-                    self.buff = self.buff[(pos+1):]
-                    pos = self.buff.find('\n')
-                    self.q.put(s)
+                self._unpack((time.time(), lines))
                 sin,_,_ = select.select([self.datasock], [], [], 0)
-        return not self.q.empty()
+        return len(self.pending) > 0 or not self.q.empty()
+
+
+
+class AckFuture(object):
+    """ The pending ack of a request made by an AsyncPedroClient.
+
+    done() - True once the ack has arrived.
+    result() - the ack (raises ValueError before it has arrived).
+    add_done_callback(fn) - call fn(future) when the ack arrives (straight
+    away if it already has).
+
+    """
+
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        if not self._done:
+            raise ValueError("ack not received yet")
+        return self._result
+
+    def add_done_callback(self, fn):
+        if self._done:
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+
+    def set_result(self, result):
+        self._result = result
+        self._done = True
+        for fn in self._callbacks:
+            fn(self)
+        self._callbacks = []
+
+
+class _LineDispatcher(asyncore.dispatcher):
+    """ An asyncore dispatcher that buffers outgoing data and hands every
+    complete line it reads to on_line. on_close (if given) is called when
+    the connection is closed from the other end.
+
+    Outgoing data is kept as a deque of chunks and an offset into the
+    first of them, so writing and sending never copy what is still queued.
+
+    """
+
+    def __init__(self, sock, socket_map, on_line, on_close = None):
+        asyncore.dispatcher.__init__(self, sock, socket_map)
+        self.on_line = on_line
+        self.on_close = on_close
+        self.lines = LineReader(sock)
+        self.out = collections.deque()
+        self.offset = 0
+
+    def handle_read(self):
+        try:
+            lines = self.lines.read()
+        except socket.error, why:
+            if why.args[0] in asyncore._DISCONNECTED:
+                self.handle_close()
+                return
+            raise
+        if lines is None:
+            self.handle_close()
+            return
+        for line in lines:
+            self.on_line(line)
+
+    def write(self, data):
+        self.out.append(data)
+
+    def writable(self):
+        return len(self.out) > 0
+
+    def handle_write(self):
+        if self.offset == 0 and len(self.out) > 1:
+            # send everything queued so far in one go
+            self.out = collections.deque([''.join(self.out)])
+        data = self.out[0]
+        self.offset += self.send(buffer(data, self.offset))
+        if self.offset == len(data):
+            self.out.popleft()
+            self.offset = 0
+
+    def handle_close(self):
+        self.close()
+        if self.on_close is not None:
+            self.on_close()
+
+
+class AsyncPedroClient(object):
+    """ A single-threaded, event-driven Pedro client.
+
+    Requests never block: register, notify, subscribe, unsubscribe,
+    deregister and p2p each return an AckFuture that completes when the
+    server acks the request. Incoming notifications are read by the same
+    asyncore loop and collected until taken with terms().
+
+    Nothing happens until the loop runs - call poll() (or poll_all() with
+    the socket map shared by several clients) regularly, or wait(future).
+    Clients that share one socket_map are all driven by one loop, without
+    a thread per socket. Only the connection handshake in connect()
+    blocks.
+
+    """
+
+    def __init__(self, machine='localhost', port=4550, socket_map=None):
+        self.machine = machine
+        self.port = port
+        if socket_map is None:
+            socket_map = {}
+        self.socket_map = socket_map
+        self.connected = False
+        self.name = ''
+        self.parser = PedroParser()
+        self.connect()
+
+    def connect(self):
+        """ Make the connection to Pedro. """
+
+        if (self.connected):
+            return 0
+        connection = _open_connection(self.machine, self.port)
+        if connection is None:
+            return 0
+        (self.machine, acksock, datasock,
+         self.id_string, self.my_machine_name) = connection
+        acksock.setblocking(0)
+        datasock.setblocking(0)
+        self.pending_acks = collections.deque()
+        self.notifications = collections.deque()
+        self.ack_channel = _LineDispatcher(acksock, self.socket_map, self._ack_received,
+                                           self._connection_lost)
+        self.data_channel = _LineDispatcher(datasock, self.socket_map, self.notifications.append,
+                                            self._connection_lost)
+        self.connected = True
+        return 1
+
+    def disconnect(self):
+        """ Disconnect the client. Requests still waiting for an ack
+        complete with 0.
+
+        """
+
+        if (self.connected):
+            self._connection_lost()
+            return 1
+        else:
+            return 0
+
+    def _connection_lost(self):
+        if (self.connected):
+            self.connected = False
+            self.ack_channel.close()
+            self.data_channel.close()
+            # no more acks will arrive
+            while self.pending_acks:
+                self.pending_acks.popleft().set_result(0)
+
+    def _ack_received(self, line):
+        self.pending_acks.popleft().set_result(int(line))
+
+    def _request(self, message):
+        """ Queue message for sending and return the AckFuture of its ack. """
+
+        future = AckFuture()
+        if (self.connected):
+            self.pending_acks.append(future)
+            self.data_channel.write(message)
+        else:
+            future.set_result(0)
+        return future
+
+    def notify(self, term):
+        return self._request(str(term)+'\n')
+
+    def subscribe(self, term, goal = "true", rock = 0):
+        return self._request('subscribe(' + str(term) + ', (' +
+                             str(goal) + '), ' + str(rock) + ')\n')
+
+    def unsubscribe(self, id):
+        return self._request('unsubscribe(' + str(id) + ')\n')
+
+    def register(self, name):
+        future = self._request('register(' + name + ')\n')
+        def registered(f):
+            if f.result() != 0:
+                self.name = name
+        future.add_done_callback(registered)
+        return future
+
+    def deregister(self):
+        future = self._request('deregister(' + self.name + ')\n')
+        def deregistered(f):
+            if f.result() != 0:
+                self.name = ''
+        future.add_done_callback(deregistered)
+        return future
+
+    def p2p(self, toaddr, term):
+        if (self.name == ''):
+            future = AckFuture()
+            future.set_result(0)
+            return future
+        return self._request(_p2p_message(self.name, self.my_machine_name, toaddr, term))
+
+    def poll(self, timeout=0.0):
+        """ Run one pass of the event loop over this client's socket map. """
+
+        poll_all(self.socket_map, timeout)
+
+    def wait(self, future, timeout=None):
+        """ Run the event loop until future is done, or for at most timeout
+        seconds; return its result. ValueError is raised if it isn't done
+        by then. If the connection is lost, pending requests complete
+        with 0.
+
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+        while not future.done() and self.connected:
+            if deadline is None:
+                self.poll(0.1)
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.poll(min(remaining, 0.1))
+        return future.result()
+
+    def notification_ready(self):
+        """ Return True iff a notification has been read and not yet taken. """
+
+        return len(self.notifications) > 0
+
+    def get_term(self):
+        """ Return the next notification read as a (term, rock) pair, or
+        None if there isn't one.
+
+        """
+
+        if not self.notifications:
+            return None
+        rock, message = self.notifications.popleft().split(" ", 1)
+        return (self.parser.parse(message), int(rock))
+
+    def terms(self):
+        """ Iterate over the (term, rock) pairs read so far. """
+
+        while self.notifications:
+            yield self.get_term()
+
+
+def poll_all(socket_map, timeout=0.0):
+    """ Run one pass of the event loop for every client sharing socket_map. """
 
+    asyncore.loop(timeout, False, socket_map, 1)
@@ -0,0 +1,102 @@
+# A compact binary log of a game session, enough to replay it exactly.
+#
+# All of a game's randomness comes from its seed, so a session is fully
+# determined by the seed, the game's settings and the set of actions
+# handed to handleActions before each simulation step. A recording is a
+# fixed header followed by those action sets as run-length encoded
+# bitmasks: (mask, count) pairs meaning "count steps with these actions".
+
+import struct
+
+
+MAGIC = "ASTR"
+VERSION = 1
+
+# the bit of each action in a mask
+ACTIONS = ("turn_left", "turn_right", "move_forward", "move_backward", "shoot",
+           "start_game", "quit")
+ACTION_BITS = dict((name, 1 << i) for i, name in enumerate(ACTIONS))
+
+# magic, version, flags, width, height, dt, seed
+HEADER = struct.Struct("<4sBBHHdq")
+RUN = struct.Struct("<BH")
+MAX_RUN = 0xffff
+
+SPLASH_SCREEN = 1
+EASY_MODE = 2
+
+
+def actionMask(actions):
+    # actions that can't affect the simulation (e.g. "clear") aren't kept
+    mask = 0
+    for action in actions:
+        mask |= ACTION_BITS.get(action, 0)
+    return mask
+
+def maskActions(mask):
+    return frozenset(name for name in ACTIONS if mask & ACTION_BITS[name])
+
+
+class Recorder(object):
+    # Writes a recording as the game runs: call record(actions) with the
+    # actions of every step, then close(). The current run is only written
+    # once it ends, so a recording that isn't closed loses its last run.
+    def __init__(self, path, seed, size, dt, splashScreen=False, easyMode=False):
+        self.file = open(path, "wb")
+        flags = (SPLASH_SCREEN if splashScreen else 0) | (EASY_MODE if easyMode else 0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, flags, size[0], size[1], dt, seed))
+        self.mask = None
+        self.count = 0
+        self.steps = 0
+
+    def record(self, actions):
+        mask = actionMask(actions)
+        if mask != self.mask or self.count == MAX_RUN:
+            self.flush()
+            self.mask = mask
+        self.count += 1
+        self.steps += 1
+
+    def flush(self):
+        if self.count:
+            self.file.write(RUN.pack(self.mask, self.count))
+            self.count = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class Recording(object):
+    # A recording read back from a file. Iterating over it gives the action
+    # set of each step in turn.
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a game recording" % path)
+
+        magic, version, flags, width, height, dt, seed = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError("%s is a version %d recording; only version %d is supported"
+                             % (path, version, VERSION))
+        self.size = (width, height)
+        self.dt = dt
+        self.seed = seed
+        self.splashScreen = bool(flags & SPLASH_SCREEN)
+        self.easyMode = bool(flags & EASY_MODE)
+
+        body = data[HEADER.size:]
+        self.runs = [RUN.unpack_from(body, i)
+                     for i in range(0, len(body) - RUN.size + 1, RUN.size)]
+        self.steps = sum(count for _, count in self.runs)
+
+    def __len__(self):
+        return self.steps
+
+    def __iter__(self):
+        for mask, count in self.runs:
+            actions = maskActions(mask)
+            for _ in xrange(count):
+                yield actions
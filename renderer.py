@@ -0,0 +1,215 @@
+# Dirty-rectangle rendering: rather than clearing and showing the whole
+# window every frame, erase only what was drawn last frame, and show only
+# the areas that were erased or drawn.
+#
+# A frame goes begin(), add() the rect of everything drawn, end(), and
+# present() the rects end() returned. When the changed area is a large
+# part of the surface it is cheaper to clear and show all of it, so then
+# the renderer falls back to a full redraw.
+#
+# Text is the other expensive thing to draw, and it hardly ever changes:
+# fonts are loaded once per process with getFont(), and rendered text is
+# kept in an LRU TextCache. Shapes are pre-rendered into a SpriteAtlas,
+# so drawing them all is one Surface.blits call.
+#
+# Drawing can also be taken out of the simulation's loop altogether: the
+# simulation publishes frames to a FrameBuffer and a render thread draws
+# the latest of them.
+
+import collections
+import threading
+
+import pygame
+
+
+class DirtyRectRenderer(object):
+    def __init__(self, surface, background, maxDirtyFraction=0.5):
+        self.surface = surface
+        self.background = background
+        self.area = surface.get_width() * surface.get_height()
+        self.maxDirtyArea = maxDirtyFraction * self.area
+
+        self.lastRects = []
+        self.rects = []
+        self.invalidate()
+
+    def invalidate(self):
+        # the whole surface needs clearing by the next begin() (if anything
+        # is drawn with the renderer) and showing by the next present(),
+        # e.g. after a title screen has been drawn over it
+        self.clearAll = True
+        self.showAll = True
+
+    def dirtyArea(self, rects):
+        # an upper bound: overlapping rects are counted twice
+        return sum(r.w * r.h for r in rects)
+
+    def begin(self):
+        if self.clearAll or self.dirtyArea(self.lastRects) > self.maxDirtyArea:
+            self.surface.fill(self.background)
+            self.lastRects = []
+            self.clearAll = False
+            self.showAll = True
+        else:
+            fill = self.surface.fill
+            background = self.background
+            for r in self.lastRects:
+                fill(background, r)
+        self.rects = []
+
+    def add(self, rect):
+        self.rects.append(rect)
+
+    def extend(self, rects):
+        self.rects.extend(rects)
+
+    def end(self):
+        # the rects to show: where things were last frame and where they
+        # are now, or None if the whole surface should be shown
+        dirty = self.lastRects + self.rects
+        self.lastRects = self.rects
+        self.rects = []
+        if self.showAll or self.dirtyArea(dirty) > self.maxDirtyArea:
+            return None
+        return dirty
+
+    def present(self, rects):
+        if rects is None or self.showAll:
+            pygame.display.update()
+            self.showAll = False
+        elif rects:
+            pygame.display.update(rects)
+
+
+_fonts = {}
+
+def getFont(name, size):
+    # the font is only loaded the first time it is asked for
+    font = _fonts.get((name, size))
+    if font is None:
+        font = _fonts[(name, size)] = pygame.font.Font(name, size)
+    return font
+
+
+class TextCache(object):
+    # Rendered text surfaces keyed by (font, text, colour, antialias), with
+    # the least recently used one evicted once there are more than size.
+    def __init__(self, size=128):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def render(self, font, text, colour, antialias=False):
+        # pygame colours aren't hashable, so the key holds a tuple of one
+        key = (font, text, tuple(colour), antialias)
+        rendered = self.entries.pop(key, None)
+        if rendered is None:
+            self.misses += 1
+            rendered = font.render(text, antialias, colour)
+            if len(self.entries) >= self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+        self.entries[key] = rendered
+        return rendered
+
+    def clear(self):
+        self.entries.clear()
+
+textCache = TextCache()
+
+
+class ScoreHud(object):
+    # The points display. The text is only rendered again when the points
+    # change; otherwise the same surface is blitted every frame.
+    def __init__(self, font, colour, position, label="Current points: "):
+        self.font = font
+        self.colour = colour
+        self.position = position
+        self.label = label
+        self.points = None
+        self.text = None
+
+    def draw(self, surface, points):
+        if points != self.points:
+            self.points = points
+            self.text = textCache.render(self.font, self.label + str(points), self.colour)
+        return surface.blit(self.text, self.position)
+
+
+class SpriteAtlas(object):
+    # Pre-rendered sprites by key. Each sprite is a surface (transparent
+    # where its colour key shows) and the offset from the point it is drawn
+    # at to the surface's top-left corner.
+    COLOUR_KEY = (255, 0, 255)
+
+    def __init__(self):
+        self.sprites = {}
+
+    def __contains__(self, key):
+        return key in self.sprites
+
+    def __getitem__(self, key):
+        return self.sprites[key]
+
+    def add(self, key, (width, height), (anchorX, anchorY), draw):
+        # draw(surface, (anchorX, anchorY)) paints the sprite on a
+        # width x height surface with the point it's drawn at at the anchor
+        surface = pygame.Surface((width, height))
+        surface.fill(SpriteAtlas.COLOUR_KEY)
+        draw(surface, (anchorX, anchorY))
+        if pygame.display.get_surface() is not None:
+            # blitting is fastest in the display's own pixel format
+            surface = surface.convert()
+        surface.set_colorkey(SpriteAtlas.COLOUR_KEY, pygame.RLEACCEL)
+        self.sprites[key] = (surface, (-anchorX, -anchorY))
+        return self.sprites[key]
+
+    def blitSequence(self, keys, xs, ys):
+        # the (surface, position) pairs for Surface.blits that draw the
+        # sprite keys[i] at (xs[i], ys[i])
+        sprites = self.sprites
+        sequence = []
+        for key, x, y in zip(keys, xs, ys):
+            surface, (dx, dy) = sprites[key]
+            sequence.append((surface, (x + dx, y + dy)))
+        return sequence
+
+
+class FrameBuffer(object):
+    # Hands frames from the simulation to a render thread. publish() never
+    # waits: it replaces any frame the renderer hasn't taken yet (counted in
+    # dropped), so the renderer always draws the latest one. Between the
+    # frame being drawn and the one waiting, that is double buffering.
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.closed = False
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, frame):
+        with self.condition:
+            if self.frame is not None:
+                self.dropped += 1
+            self.frame = frame
+            self.published += 1
+            self.condition.notify()
+
+    def take(self):
+        # wait for a frame and take it; None once the buffer is closed
+        with self.condition:
+            while self.frame is None and not self.closed:
+                self.condition.wait()
+            frame, self.frame = self.frame, None
+        return frame
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.frame = None
+            self.condition.notify_all()
@@ -0,0 +1,120 @@
+# A uniform grid broad phase over the game's wrap-around (toroidal) space.
+#
+# Items are bucketed by the cell their centre falls in; the grid keeps the
+# item indices sorted by cell together with the start offset of every cell,
+# so all items in a cell are one contiguous slice. Queries return candidate
+# indices only: callers still do the exact distance test themselves.
+
+import math
+import numpy as np
+
+
+class SpatialGrid(object):
+    # with no more items than this the grid isn't worth consulting
+    SMALL = 16
+
+    def __init__(self, width, height, cellSize=64):
+        self.width = width
+        self.height = height
+        self.cellSize = cellSize
+        self.cols = int(math.ceil(width / float(cellSize)))
+        self.rows = int(math.ceil(height / float(cellSize)))
+        self.numCells = self.cols * self.rows
+
+        self.cells = np.zeros(0, dtype=np.intp)
+        self.order = np.zeros(0, dtype=np.intp)
+        self.cellStart = np.zeros(self.numCells + 1, dtype=np.intp)
+
+        # lets the owner tell whether the grid is up to date with its items
+        self.generation = None
+
+    def __len__(self):
+        return len(self.cells)
+
+    def cellCoords(self, x, y):
+        cx = np.floor_divide(x, self.cellSize).astype(np.intp) % self.cols
+        cy = np.floor_divide(y, self.cellSize).astype(np.intp) % self.rows
+        return cx, cy
+
+    def rebuild(self, x, y):
+        cx, cy = self.cellCoords(x, y)
+        cells = cy * self.cols + cx
+
+        if len(cells) == len(self.cells) and np.array_equal(cells, self.cells):
+            # nobody changed cell since the last frame
+            return
+
+        if len(cells) == len(self.order):
+            # most items stay in the same cell from frame to frame, so
+            # starting from last frame's ordering hands the stable sort an
+            # almost sorted sequence
+            order = self.order[np.argsort(cells[self.order], kind="mergesort")]
+        else:
+            order = np.argsort(cells, kind="mergesort")
+
+        self.cells = cells
+        self.order = order
+        self.cellStart[0] = 0
+        np.cumsum(np.bincount(cells, minlength=self.numCells), out=self.cellStart[1:])
+
+    def reach(self, radius):
+        # how many cells either side of a cell can hold something within radius
+        return int(math.ceil(radius / float(self.cellSize)))
+
+    def prunes(self, radius, count):
+        # whether a query of radius over count items can rule any of them
+        # out: not if there are only a few, or if the cells within reach
+        # cover the whole grid on both axes
+        reach = self.reach(radius)
+        return count > SpatialGrid.SMALL and \
+               (2 * reach + 1 < self.cols or 2 * reach + 1 < self.rows)
+
+    def _axisCells(self, c, reach, n):
+        # the (wrapped) cells along one axis within reach of each c, without
+        # visiting any cell twice when the reach covers the whole axis
+        if 2 * reach + 1 >= n:
+            return np.tile(np.arange(n), (len(c), 1))
+        offsets = np.arange(-reach, reach + 1)
+        return (c[:,np.newaxis] + offsets) % n
+
+    def _neighbourCells(self, x, y, reach):
+        cx, cy = self.cellCoords(x, y)
+        xs = self._axisCells(cx, reach, self.cols)
+        ys = self._axisCells(cy, reach, self.rows)
+        return (ys[:,:,np.newaxis] * self.cols + xs[:,np.newaxis,:]).reshape(len(cx), -1)
+
+    def candidatePairs(self, x, y, radius):
+        # For every query point (x[i], y[i]) find the items whose cell lies
+        # within radius of the point's cell. Returns two equal-length arrays
+        # (point indices, item indices) listing each candidate pair once.
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if len(x) == 0 or len(self.cells) == 0:
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty
+
+        count = len(self.cells)
+        if not self.prunes(radius, count):
+            # every item is a candidate for every point
+            return (np.repeat(np.arange(len(x)), count),
+                    np.tile(np.arange(count), len(x)))
+
+        neighbours = self._neighbourCells(x, y, self.reach(radius))
+        perPoint = neighbours.shape[1]
+
+        starts = self.cellStart[neighbours].ravel()
+        counts = self.cellStart[neighbours + 1].ravel() - starts
+        total = counts.sum()
+
+        slot = np.repeat(np.arange(len(counts)), counts)
+        firstOfSlot = np.cumsum(counts) - counts
+        positions = starts[slot] + (np.arange(total) - firstOfSlot[slot])
+
+        return slot // perPoint, self.order[positions]
+
+    def queryRadius(self, x, y, radius):
+        # candidate items within radius of the single point (x, y)
+        if not self.prunes(radius, len(self.cells)):
+            return np.arange(len(self.cells))
+        _, items = self.candidatePairs([x], [y], radius)
+        return items